@@ -1,7 +1,174 @@
 #!/usr/bin/env python3
+"""Create plots from the command line.
+
+Either a single plot (options describe the query), or many plots at once,
+described by a job file and/or a parameter grid. Data are loaded only once
+per process, optionally in a pool of processes.
+"""
+import csv
+import itertools
+import json
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from time import time
+
 import click
-from data_source import get_temperature_data
-from data_source import plot_temperature_data
+
+from plotting import render_temperature_data
+
+
+# Parameters of a plot (the same as command-line options) and their types
+JOB_PARAMETERS = OrderedDict([
+    ("x", str), ("y", str), ("id", str), ("address", str),
+    ("month", int), ("hour", int), ("year", int),
+    ("altitude", str), ("greenery", str),
+    ("width", int), ("height", int),
+])
+MANIFEST_FILE = "manifest.json"
+
+
+def parse_range(value, convert, name):
+    """Convert "200,300" (or [200, 300]) to a tuple, empty value to None."""
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = value.split(",")
+    value = tuple(convert(v) for v in value)
+    if len(value) != 2:
+        raise ValueError("{0} must be set as two comma-separated values".format(name))
+    return value
+
+
+def make_query(x, y, id, month, hour, year, altitude, greenery, address, **kwargs):
+    """Convert plot parameters to query arguments of render_temperature_data.
+
+    Empty strings and negative numbers mean "not selected".
+    Other parameters (width, height, ...) are ignored.
+
+    Returns
+    -------
+    kwargs : dict
+    """
+    query = dict(
+        id=id or None,
+        hour=hour if hour is not None and hour >= 0 else None,
+        month=month if month is not None and month >= 0 else None,
+        year=year if year is not None and year >= 0 else None,
+        altitude_range=parse_range(altitude, int, "Altitude"),
+        greenery_range=parse_range(greenery, float, "Greenery"),
+        axes=(x, y),
+        address=address,
+    )
+    return query
+
+
+def read_jobs(path):
+    """Read parameter sets from a CSV (with a header) or JSON lines file.
+
+    Empty values are left out (the command-line options apply),
+    values of known parameters are converted to their types.
+
+    Returns
+    -------
+    jobs : list[dict]
+    """
+    with open(path, encoding="utf-8", newline="") as f:
+        if path.endswith(".csv"):
+            jobs = list(csv.DictReader(f))
+        else:
+            jobs = [json.loads(line) for line in f if line.strip()]
+    result = []
+    for job in jobs:
+        job = {key: value for key, value in job.items() if value not in ("", None)}
+        for key, convert in JOB_PARAMETERS.items():
+            if key in job and isinstance(job[key], str):
+                job[key] = convert(job[key])
+        result.append(job)
+    return result
+
+
+def expand_grid(specs):
+    """All combinations of parameter values.
+
+    Parameters
+    ----------
+    specs : list[str]
+        Like "month=1..12" (inclusive range) or "altitude=200,300;300,400" (list)
+
+    Returns
+    -------
+    jobs : list[dict]
+    """
+    names, values = [], []
+    for spec in specs:
+        name, _, text = spec.partition("=")
+        if name not in JOB_PARAMETERS or not text:
+            raise click.BadParameter("Invalid grid specification: {0}".format(spec))
+        if ".." in text:
+            start, stop = text.split("..")
+            values.append(list(range(int(start), int(stop) + 1)))
+        else:
+            values.append([JOB_PARAMETERS[name](v) for v in text.split(";")])
+        names.append(name)
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def run_job(job):
+    """Render one plot, never raises.
+
+    Returns
+    -------
+    record : dict
+        Item of the manifest
+    """
+    start = time()
+    parameters = {key: value for key, value in job.items() if key not in ("output", "use_cache")}
+    error = None
+    try:
+        query = make_query(**parameters)
+        render_temperature_data(job["output"], width=job["width"], height=job["height"],
+                                use_cache=job["use_cache"], **query)
+    except Exception as err:
+        error = "{0}: {1}".format(type(err).__name__, err)
+    return OrderedDict([("output", job["output"]), ("parameters", parameters),
+                        ("seconds", round(time() - start, 4)), ("error", error)])
+
+
+def run_jobs(jobs, workers=1):
+    """Render all jobs, in parallel if workers != 1.
+
+    Parameters
+    ----------
+    jobs : list[dict]
+        Full sets of parameters (see JOB_PARAMETERS) with "output" and "use_cache"
+    workers : int
+        Number of processes (0 = number of CPUs)
+
+    Returns
+    -------
+    records : list[dict]
+    """
+    if workers == 1 or len(jobs) <= 1:
+        return [run_job(job) for job in jobs]
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Each worker loads the data once, larger chunks keep its caches warm
+        chunk_size = max(1, len(jobs) // (4 * workers))
+        return list(executor.map(run_job, jobs, chunksize=chunk_size))
+
+
+def write_manifest(records, path, seconds):
+    manifest = OrderedDict([
+        ("created", datetime.now().isoformat(timespec="seconds")),
+        ("seconds", round(seconds, 3)),
+        ("count", len(records)),
+        ("errors", sum(1 for record in records if record["error"])),
+        ("jobs", records),
+    ])
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
 
 
 @click.command()
@@ -16,39 +183,66 @@ from data_source import plot_temperature_data
 @click.option("--address", default="", help="Address of sensors")
 @click.option("--width", default=1024)
 @click.option("--height", default=768)
+@click.option("--no-cache", is_flag=True, help="Always render the image (do not use the image cache)")
+@click.option("--jobs", "jobs_path", default=None, type=click.Path(exists=True),
+              help="Plot parameters, one set per line (JSON lines, or CSV with a header)")
+@click.option("--grid", multiple=True,
+              help="Plot all values of a parameter, like \"month=1..12\" or \"address=A;B\" (repeatable)")
+@click.option("--workers", default=1, help="Number of processes for many plots (0 = number of CPUs)")
+@click.option("--manifest", default=None, help="Where to write the list of outputs and timings")
 @click.argument("output_path")
-def batch(x, y, id, output_path, month, hour, year, altitude, greenery, width, height, address):
-    if not id:
-        id = None
-    if hour < 0:
-        hour = None
-    if month < 0:
-        month = None
-    if year < 0:
-        year = None
-    if altitude:
-        altitude=tuple((int(a) for a in altitude.split(",")))
-        if len(altitude) != 2:
-            print("Altitude must be set as two comma-separated values")
-            exit(-1)
-    else:
-        altitude=None
-        
-    if greenery:
-        greenery=tuple((float(a) for a in greenery.split(",")))
-        if len(greenery) != 2:
-            print("Greenery must be set as two comma-separated values")
+def batch(x, y, id, output_path, month, hour, year, altitude, greenery, width, height, address, no_cache,
+          jobs_path, grid, workers, manifest):
+    """Plot data into OUTPUT_PATH.
+
+    With --jobs or --grid, OUTPUT_PATH is a template formatted with the parameters
+    of each plot (and its index), like "plots/{month}-{hour}.png". Jobs can also
+    set their "output" explicitly. Each job from the file is combined with each grid point.
+    """
+    defaults = dict(x=x, y=y, id=id, month=month, hour=hour, year=year, altitude=altitude,
+                    greenery=greenery, address=address, width=width, height=height)
+    if jobs_path or grid:
+        start = time()
+        variants = read_jobs(jobs_path) if jobs_path else [{}]
+        points = expand_grid(grid) if grid else [{}]
+        jobs = []
+        for index, (variant, point) in enumerate(itertools.product(variants, points)):
+            job = dict(defaults, **variant)
+            job.update(point)
+            if "output" not in job:
+                job["output"] = output_path.format(index=index, **job)
+            job["use_cache"] = not no_cache
+            jobs.append(job)
+        if len(set(job["output"] for job in jobs)) < len(jobs):
+            raise click.UsageError("Output paths are not unique, use a template like \"plots/{month}-{hour}.png\".")
+        for output_dir in set(os.path.dirname(job["output"]) for job in jobs):
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+
+        records = run_jobs(jobs, workers)
+        manifest = manifest or os.path.join(os.path.dirname(jobs[0]["output"]), MANIFEST_FILE)
+        write_manifest(records, manifest, time() - start)
+        errors = [record for record in records if record["error"]]
+        for record in errors:
+            print("{0}: {1}".format(record["output"], record["error"]))
+        print("{0} outputs written in {1:.1f} s ({2} failed), manifest in {3}.".format(
+            len(records) - len(errors), time() - start, len(errors), manifest))
+        if errors:
             exit(-1)
-    else:
-        greenery=None
+        return
+
+    try:
+        query = make_query(**defaults)
+    except ValueError as err:
+        print(err)
+        exit(-1)
     try:
-        data = get_temperature_data(id=id, hour=hour, month=month, year=year, altitude_range=altitude, greenery_range=greenery, axes=(x, y), address=address)
+        render_temperature_data(output_path, width=width, height=height, use_cache=not no_cache, **query)
     except RuntimeError as err:
         print("Cannot read data.")
         print(err)
         exit(-1)        
 
-    plot_temperature_data(data, output_path, width=width, height=height)
     print("Output written to {0}.".format(output_path))
     
     
@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""Timings of the data preparation, query and plotting pipeline.
+
+Synthetic raw data and a meta-data table of the requested size are
+generated in a working directory, histograms are created from them and
+the functions used in production are timed there (each several times,
+the best and the median are reported). Results are written as JSON,
+together with the commit and the parameters, so that runs on different
+commits can be compared (see --baseline).
+
+Queries are timed with warm data caches (as in a long-running
+process) but with an empty result cache, so that the query itself
+is measured.
+"""
+
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import OrderedDict
+from datetime import datetime
+from time import perf_counter
+
+import click
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import data_source
+import prepare
+from plotting import plot_temperature_data
+
+
+RAW_FILE = "raw.csv"
+FIRST_YEAR = prepare.YEAR_RANGE[0]
+# Sensors sharing one address
+SENSORS_PER_ADDRESS = 4
+# Filters of the filter queries (the altitudes are generated from 200 to 400 m)
+ALTITUDE_RANGE = (250, 300)
+GREENERY_RANGE = (0.2, 0.4)
+
+
+def generate_metadata(path, sensors, seed=0):
+    """Write a master measure point table with synthetic sensors.
+
+    Returns
+    -------
+    ids : list[str]
+        Sensor ids (lower-case, as used in queries)
+    """
+    rng = np.random.RandomState(seed)
+    ids = ["S{0:05d}".format(i) for i in range(sensors)]
+    addresses = ["Street {0}".format(i // SENSORS_PER_ADDRESS) for i in range(sensors)]
+    green = rng.uniform(0, 1, size=(sensors, 3))
+    table = pd.DataFrame(OrderedDict([
+        ("GPS lat", rng.uniform(49.15, 49.27, sensors)),
+        ("GPS lon", rng.uniform(16.5, 16.7, sensors)),
+        ("Adresa", addresses),
+        ("Adresa interní", addresses),
+        ("Městská část", "Brno"),
+        ("vyska", np.round(rng.uniform(200, 400, sensors), 1)),
+        ("Typ zdroje", "PK"),
+        ("Systém", ids),
+        ("Popis", ids),
+        ("0.001", green[:, 0]),
+        ("0.005", green[:, 1]),
+        ("0.01", green[:, 2]),
+    ]))
+    table.to_csv(path, sep=";", index=False)
+    return [id.lower() for id in ids]
+
+
+def generate_raw_data(path, ids, years, rows, seed=0):
+    """Write a raw CSV file (in the format read by prepare.parse_data_file).
+
+    Measurements of random sensors at random times of the years
+    starting with FIRST_YEAR.
+    """
+    rng = np.random.RandomState(seed)
+    start = np.datetime64("{0}-01-01".format(FIRST_YEAR), "s")
+    end = np.datetime64("{0}-01-01".format(FIRST_YEAR + years), "s")
+    seconds = rng.randint(0, (end - start).astype(np.int64), size=rows)
+    timestamps = pd.Series(start + seconds.astype("timedelta64[s]")).dt.strftime("%Y-%m-%d %H:%M:%S")
+    places = np.array(["Brno\\{0}\\T".format(id.upper()) for id in ids])[rng.randint(0, len(ids), size=rows)]
+    temperatures = pd.Series(np.round(rng.normal(10, 10, size=rows), 1)).map("{0:.1f}".format).str.replace(".", ",", regex=False)
+    pd.DataFrame({"datetime": timestamps, "place": places, "temperature": temperatures}).to_csv(
+        path, sep=";", header=False, index=False, columns=["datetime", "place", "temperature"])
+
+
+def measure(function, repeat, setup=None):
+    """Time repeated calls of a function.
+
+    Parameters
+    ----------
+    function : callable
+        Called without arguments
+    repeat : int
+    setup : callable (optional)
+        Called (untimed) before each call
+
+    Returns
+    -------
+    record : dict
+        Best and median time and all times in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return OrderedDict([("best", min(times)), ("median", statistics.median(times)), ("times", times)])
+
+
+def clear_results():
+    data_source.result_cache.clear()
+
+
+def run_benchmarks(ids, years, repeat, output_format="json"):
+    """Time the pipeline in the current directory (with generated data).
+
+    Returns
+    -------
+    results : OrderedDict
+        Name -> record (see measure)
+    """
+    results = OrderedDict()
+    max_year = FIRST_YEAR + years - 1
+    data = prepare.parse_data_file(RAW_FILE, max_year=max_year)
+    results["parse_data_file"] = measure(lambda: prepare.parse_data_file(RAW_FILE, max_year=max_year), repeat)
+
+    if output_format in ("json", "both"):
+        results["create_histogram_files"] = measure(
+            lambda: prepare.create_histogram_files(data, data_source.DATA_DIR), repeat)
+    if output_format in ("store", "both"):
+        results["create_histogram_store"] = measure(
+            lambda: prepare.create_histogram_store(data, data_source.STORE_DIR), repeat)
+
+    id = ids[0]
+    data_source.get_available_points()
+    results["read_data"] = measure(lambda: data_source.read_data(id), repeat,
+                                   setup=data_source.read_data.cache_clear)
+    results["find_points"] = measure(
+        lambda: data_source.find_points(altitude_range=ALTITUDE_RANGE, greenery_range=GREENERY_RANGE), repeat)
+
+    queries = OrderedDict([
+        ("get_temperature_data[id]", dict(id=id, axes=("month", "temperature"))),
+        ("get_temperature_data[id, hour]", dict(id=id, hour=12, axes=("month", "temperature"))),
+        ("get_temperature_data[address]", dict(address=data_source.get_point_meta_data(id)["Adresa"],
+                                               axes=("month", "temperature"))),
+        ("get_temperature_data[altitude]", dict(altitude_range=ALTITUDE_RANGE, axes=("hour", "temperature"))),
+        ("get_temperature_data[altitude, greenery, month]", dict(altitude_range=ALTITUDE_RANGE,
+                                                                 greenery_range=GREENERY_RANGE,
+                                                                 month=7, axes=("hour", "temperature"))),
+    ])
+    for name, query in queries.items():
+        data_source.get_temperature_data(**query)    # Load the data involved
+        results[name] = measure(lambda: data_source.get_temperature_data(**query), repeat, setup=clear_results)
+
+    histogram = data_source.get_temperature_data(altitude_range=ALTITUDE_RANGE, axes=("hour", "temperature"))
+    results["plot_temperature_data"] = measure(lambda: plot_temperature_data(histogram, path="plot.png"), repeat)
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode("ascii").strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Print relative changes of median times against a previous run.
+
+    Returns
+    -------
+    ratios : dict
+        Name -> median / baseline median (for benchmarks in both runs)
+    """
+    ratios = OrderedDict()
+    print("{0:<50} {1:>10} {2:>10} {3:>8}".format("benchmark", "base ms", "ms", "ratio"))
+    for name, record in results.items():
+        if name not in baseline["results"]:
+            continue
+        base = baseline["results"][name]["median"]
+        ratios[name] = record["median"] / base
+        print("{0:<50} {1:>10.2f} {2:>10.2f} {3:>8.2f}".format(name, base * 1000, record["median"] * 1000,
+                                                               ratios[name]))
+    return ratios
+
+
+@click.command()
+@click.option("--sensors", default=100, help="Number of sensors")
+@click.option("--years", default=3, help="Number of years of data")
+@click.option("--rows", default=100000, help="Rows of raw data")
+@click.option("--repeat", default=5, help="Runs of each benchmark")
+@click.option("--format", "output_format", type=click.Choice(["json", "store", "both"]), default="json",
+              help="Histograms to create and query (as in prepare.py)")
+@click.option("--workdir", default=None, help="Where to generate the data (default: a temporary directory)")
+@click.option("--output", default=None, help="Where to write the results (JSON)")
+@click.option("--baseline", default=None, type=click.Path(exists=True), help="Results of a previous run to compare with")
+@click.option("--tolerance", default=0.0, help="With --baseline, fail if a median is slower by more than this ratio (like 0.2)")
+def run(sensors, years, rows, repeat, output_format, workdir, output, baseline, tolerance):
+    """Generate synthetic data and time the pipeline on them."""
+    output = output and os.path.abspath(output)
+    temporary = workdir is None
+    workdir = tempfile.mkdtemp(prefix="hot-plots-bench-") if temporary else workdir
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(workdir)    # data_source works with paths relative to the current directory
+    try:
+        ids = generate_metadata(data_source.CSV_FILE, sensors)
+        generate_raw_data(RAW_FILE, ids, years, rows)
+        results = run_benchmarks(ids, years, repeat, output_format)
+    finally:
+        os.chdir(cwd)
+        if temporary:
+            shutil.rmtree(workdir)
+
+    report = OrderedDict([
+        ("created", datetime.now().isoformat(timespec="seconds")),
+        ("commit", get_commit()),
+        ("python", platform.python_version()),
+        ("parameters", OrderedDict([("sensors", sensors), ("years", years), ("rows", rows),
+                                    ("repeat", repeat), ("format", output_format)])),
+        ("results", results),
+    ])
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if baseline:
+        with open(baseline, encoding="utf-8") as f:
+            ratios = compare(results, json.load(f))
+        slower = [name for name, ratio in ratios.items() if ratio > 1 + tolerance]
+        if tolerance and slower:
+            print("Slower than the baseline: {0}".format(", ".join(slower)))
+            exit(-1)
+    else:
+        print("{0:<50} {1:>10} {2:>10}".format("benchmark", "best ms", "median ms"))
+        for name, record in results.items():
+            print("{0:<50} {1:>10.2f} {2:>10.2f}".format(name, record["best"] * 1000, record["median"] * 1000))
+
+
+if __name__ == "__main__":
+    run()
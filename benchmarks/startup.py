@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""Start-up time of typical entry points.
+
+Each scenario runs in a fresh interpreter (several times, the median is
+reported) together with the list of heavy modules it imported.
+Use --repo to measure another checkout (e.g. an older commit in a git worktree)
+against the same data (the current directory).
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+from time import perf_counter
+
+import click
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["pandas", "physt", "matplotlib", "matplotlib.pyplot", "czech_sort"]
+
+SCENARIOS = [
+    ("import data_source", "import data_source"),
+    ("list points", "import data_source; data_source.get_available_points()"),
+    ("query", "import data_source; data_source.get_temperature_data(altitude_range=(200, 300), axes=('hour', 'temperature'))"),
+    ("import batch", "import batch"),
+]
+
+CHILD_CODE = """
+import sys, json
+sys.path.insert(0, {repo!r})
+{code}
+print(json.dumps([name for name in {modules!r} if name in sys.modules]))
+"""
+
+
+def run_scenario(code, repo=REPO_DIR, repeat=5):
+    """Run code in fresh interpreters.
+
+    Returns
+    -------
+    times : list[float]
+        Wall time of each run in seconds (including interpreter start)
+    modules : list[str]
+        Heavy modules imported by the code
+    """
+    child = CHILD_CODE.format(repo=repo, code=code, modules=HEAVY_MODULES)
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        output = subprocess.run([sys.executable, "-W", "ignore", "-c", child], stdout=subprocess.PIPE, check=True).stdout
+        times.append(perf_counter() - start)
+    return times, json.loads(output.decode("utf-8").splitlines()[-1])
+
+
+@click.command()
+@click.option("--repo", default=REPO_DIR, help="Checkout of the code to measure")
+@click.option("--repeat", default=5, help="Runs of each scenario")
+def run(repo, repeat):
+    """Measure start-up of typical entry points (run it in the directory with data)."""
+    baseline, _ = run_scenario("pass", repo, repeat)
+    print("{0:<20} {1:>8}  {2}".format("scenario", "ms", "heavy modules"))
+    print("{0:<20} {1:>8.0f}".format("(interpreter)", statistics.median(baseline) * 1000))
+    for name, code in SCENARIOS:
+        times, modules = run_scenario(code, repo, repeat)
+        print("{0:<20} {1:>8.0f}  {2}".format(name, statistics.median(times) * 1000, ", ".join(modules)))
+
+
+if __name__ == "__main__":
+    run()
@@ -1,19 +1,40 @@
-"""Data loading and plotting functions."""
+"""Data loading functions.
+
+Plotting is in the plotting module. To keep start-up fast, this module
+does not import matplotlib, and physt is imported only when JSON histograms
+are read.
+"""
 
-from physt.io import load_json
 from time import time
-import matplotlib.pyplot as plt
 from functools import lru_cache
+import numpy as np
 import pandas as pd
 from collections import OrderedDict
-from czech_sort import sorted as czech_sorted
 import os
-from matplotlib.ticker import MultipleLocator
-import matplotlib
-import matplotlib.font_manager as fm
+import hashlib
+from histogram_store import HistogramStore, HEADER_FILE
+from point_index import PointIndex
+from histogram_data import Histogram
+from query_cache import ResultCache, ImageCache
 
 
 CSV_FILE = "Adresace_zdroju_s_GPS_vysky_lesy_parsed.csv"
+DATA_DIR = "data"
+STORE_DIR = os.path.join(DATA_DIR, "store")
+# Outside of DATA_DIR, so that writing the cache does not change the data version
+IMAGE_CACHE_DIR = os.path.join(".cache", "images")
+# Record of raw data files already ingested (written by prepare.py)
+INGESTED_FILE = "ingested.json"
+# Results of get_temperature_data (in memory, optionally on disk)
+result_cache = ResultCache()
+# Images rendered by plotting.render_temperature_data
+image_cache = ImageCache(IMAGE_CACHE_DIR)
+_data_version = None
+# Histograms kept by read_data (JSON histograms are read fully into memory)
+READ_DATA_CACHE_SIZE = 256
+# (key, ids) of the last scan of available points (see get_available_points)
+_availability = None
+
 MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
 
 
@@ -49,16 +70,51 @@ def get_all_point_metadata(path=CSV_FILE):
     return data
     
 
-@lru_cache(1)
 def get_available_points(only_with_data=True):
     """All available point ids.
     
+    Points with data are found by one scan of the data directory
+    and the store header. The scan is repeated only when the directory,
+    the store or the meta-data table change, caches depending
+    on the set of points are cleared then.
+    
     Returns
     -------
     ids : list
     """
-    data = get_all_point_metadata(path=CSV_FILE)
-    return sorted([i for i in data.index if has_data(i) or not only_with_data])
+    global _availability
+    if not only_with_data:
+        return sorted(get_all_point_metadata(path=CSV_FILE).index)
+    key = _availability_key()
+    if _availability is None or _availability[0] != key:
+        if _availability is not None:
+            _clear_caches()
+        ids = _scan_available_ids()
+        data = get_all_point_metadata(path=CSV_FILE)
+        _availability = key, sorted(i for i in data.index if i in ids)
+    return _availability[1]
+    
+    
+def _availability_key():
+    # Directory mtime changes when files are added, removed or renamed
+    key = []
+    for path in (CSV_FILE, DATA_DIR, os.path.join(STORE_DIR, HEADER_FILE)):
+        try:
+            key.append(os.stat(path).st_mtime_ns)
+        except FileNotFoundError:
+            key.append(None)
+    return tuple(key)
+    
+    
+def _scan_available_ids():
+    ids = set()
+    if os.path.isdir(DATA_DIR):
+        with os.scandir(DATA_DIR) as entries:
+            ids.update(entry.name[:-5] for entry in entries if entry.name.endswith(".json"))
+    store = get_store()
+    if store is not None:
+        ids.update(store.ids)
+    return ids
     
     
 def has_data(id):
@@ -68,7 +124,26 @@ def has_data(id):
     -------
     bool
     """
-    return os.path.exists(os.path.join("data", "{0}.json".format(id)))
+    store = get_store()
+    if store is not None and id in store:
+        return True
+    return os.path.exists(os.path.join(DATA_DIR, "{0}.json".format(id)))
+
+
+@lru_cache(1)
+def get_store(path=STORE_DIR):
+    """Cached histogram store (see prepare.create_histogram_store).
+    
+    The frequencies are memory-mapped, not read into memory.
+    
+    Returns
+    -------
+    store : histogram_store.HistogramStore or None
+        None if the store was not created.
+    """
+    if not os.path.exists(os.path.join(path, HEADER_FILE)):
+        return None
+    return HistogramStore(path)
 
     
 def get_point_meta_data(id):
@@ -84,7 +159,6 @@ def get_point_meta_data(id):
         raise RuntimeError("Point {0} not in the database.".format(id))
         
 
-@lru_cache(1)    
 def get_point_tree():
     """Tree city part/points in it.
     
@@ -94,16 +168,54 @@ def get_point_tree():
         Keys of the dictionary are the city parts.
         Values are full tables of points.
     """
+    get_available_points()      # Drops the cached tree if points changed
+    return _get_point_tree()
+    
+    
+@lru_cache(1)    
+def _get_point_tree():
     available = get_available_points()
     data = get_all_point_metadata()
     data = data.loc[available]
+    from czech_sort import sorted as czech_sorted
     result = OrderedDict()
     for part in czech_sorted(data["Městská část"].unique()):
         result[part] = data[data["Městská část"] == part]
     return result
     
     
-@lru_cache(20)
+def get_point_index():
+    """Cached index of available points.
+    
+    Returns
+    -------
+    index : point_index.PointIndex
+    """
+    get_available_points()      # Drops the cached index if points changed
+    return _get_point_index()
+    
+    
+@lru_cache(1)
+def _get_point_index():
+    return PointIndex(get_all_point_metadata().loc[get_available_points()])
+    
+    
+@lru_cache(1)
+def get_store_rows():
+    """Rows of the store for all points of the point index.
+    
+    Returns
+    -------
+    rows : np.ndarray or None
+        Integer array aligned with get_point_index().ids, -1 for points not in the store.
+        None if there is no store.
+    """
+    store = get_store()
+    if store is None:
+        return None
+    return np.array([store.index.get(id, -1) for id in get_point_index().ids], dtype=np.intp)
+    
+    
 def find_points(address=None, altitude_range=None, greenery_range=None):
     """All points at an address.
     
@@ -112,27 +224,215 @@ def find_points(address=None, altitude_range=None, greenery_range=None):
     points : pd.DataFrame
         Empty or non-empty
     """
-    data = get_all_point_metadata()
-    if address:
-        data = data[data["Adresa"] == address]
-    if altitude_range:
-        data = data[(data["vyska"] >= altitude_range[0]) & (data["vyska"] <= altitude_range[1])]
-    if greenery_range:
-        data = data[(data["greenery"] >= greenery_range[0]) & (data["greenery"] <= greenery_range[1])]
-    available = get_available_points()
-    data = data.loc[set(available) & set(data.index)]
-    return data
+    index = get_point_index()
+    positions = index.positions(address=address, altitude_range=altitude_range, greenery_range=greenery_range)
+    return get_all_point_metadata().loc[index.ids[positions]]
     
 
+@lru_cache(READ_DATA_CACHE_SIZE)
 def read_data(id):
     """Read the full histogram for a point.
     
+    The most recently used results are cached, treat them as read-only.
+    The histogram store is preferred to JSON files if it contains the point.
+    
+    Returns
+    -------
+    h : histogram_data.Histogram
+    """
+    store = get_store()
+    if store is not None and id in store:
+        return store.view(id)
+    path = os.path.join(DATA_DIR, "{0}.json".format(id))
+    from physt.io import load_json
+    return Histogram.from_physt(load_json(path))
+    
+    
+@lru_cache(2)
+def get_prefix_sums(column):
+    """Cached prefix sums of the histogram store along a meta-data column.
+    
+    Parameters
+    ----------
+    column : str
+        "vyska" or "greenery" (see prepare.create_prefix_sums)
+    
+    Returns
+    -------
+    prefix_sums : histogram_store.PrefixSums or None
+        None if not precomputed or not matching the current points.
+    """
+    store = get_store()
+    if store is None or not store.has_prefix_sums(column):
+        return None
+    prefix_sums = store.prefix_sums(column)
+    values = get_all_point_metadata().loc[get_available_points(), column].dropna()
+    if len(values) != len(prefix_sums.ids) or set(values.index) != set(prefix_sums.ids):
+        return None
+    if not np.array_equal(values.loc[prefix_sums.ids].values, prefix_sums.keys):
+        return None
+    return prefix_sums
+    
+
+def sum_histograms(address=None, altitude_range=None, greenery_range=None):
+    """Sum of histograms of all points matching the criteria.
+    
+    A single altitude or greenery range is served from the precomputed
+    prefix sums (if available), other combinations are aggregated
+    from the store and/or JSON files. Ranges covering all points
+    (like the full range of a GUI slider) are ignored, so that moving
+    one slider is served from the prefix sums as well.
+    
+    Returns
+    -------
+    h : histogram_data.Histogram or None
+        None if no point matches.
+    """
+    index = get_point_index()
+    if altitude_range and index.covers("vyska", *altitude_range):
+        altitude_range = None
+    if greenery_range and index.covers("greenery", *greenery_range):
+        greenery_range = None
+    if not address and bool(altitude_range) != bool(greenery_range):
+        if altitude_range:
+            prefix_sums, value_range = get_prefix_sums("vyska"), altitude_range
+        else:
+            prefix_sums, value_range = get_prefix_sums("greenery"), greenery_range
+        if prefix_sums is not None:
+            return prefix_sums.range_sum(*value_range)
+        
+    positions = index.positions(address=address, altitude_range=altitude_range, greenery_range=greenery_range)
+    histograms = []
+    store = get_store()
+    if store is not None:
+        rows = get_store_rows()[positions]
+        in_store = rows >= 0
+        if in_store.any():
+            histograms.append(store.aggregate(rows[in_store]))
+        positions = positions[~in_store]
+    histograms += [read_data(id_) for id_ in index.ids[positions]]
+    if not histograms:
+        return None
+    return sum(histograms)
+    
+
+def get_data_version():
+    """Version of all data that queries depend on.
+    
+    Derived from sizes and modification times of the meta-data table,
+    the data and store directories, the store header and the record
+    of ingested files, without listing the directories. Histogram files
+    are written by replacing them (see prepare.write_histogram_files and
+    histogram_store.write_store), which changes the directory mtime.
+    
+    A file overwritten in place (cp, rsync --inplace) leaves the directory
+    unchanged and is not noticed; call refresh_caches(force=True) then.
+    
+    Returns
+    -------
+    version : str
+    """
+    parts = []
+    for path in (CSV_FILE, DATA_DIR, STORE_DIR, os.path.join(STORE_DIR, HEADER_FILE),
+                 os.path.join(DATA_DIR, INGESTED_FILE)):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        parts.append((path, stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()
+    
+    
+def _clear_caches():
+    """Forget all data read so far (as in a new process)."""
+    global _availability
+    for function in (get_all_point_metadata, get_store, _get_point_index, get_store_rows,
+                     _get_point_tree, read_data, get_prefix_sums):
+        function.cache_clear()
+    _availability = None
+    result_cache.clear()
+    
+    
+def refresh_caches(force=False):
+    """Clear all cached data if they changed since the last call.
+    
+    Parameters
+    ----------
+    force : bool
+        Clear the caches anyway and touch the data directory,
+        so that other processes and the image cache see a new version
+        (for files changed in a way get_data_version does not notice)
+    
+    Returns
+    -------
+    version : str
+        Current version of the data (see get_data_version)
+    """
+    global _data_version
+    if force and os.path.isdir(DATA_DIR):
+        try:
+            os.utime(DATA_DIR)
+        except OSError:
+            pass    # Read-only data, at least this process reloads them
+    version = get_data_version()
+    if force or version != _data_version:
+        if force or _data_version is not None:
+            _clear_caches()
+        _data_version = version
+    return version
+    
+    
+def configure_result_cache(max_bytes=None, directory=None, max_disk_bytes=None):
+    """Change limits of the result cache or enable storing results on disk.
+    
+    Parameters
+    ----------
+    max_bytes : int (optional)
+        Size limit of results kept in memory
+    directory : str (optional)
+        Where to pickle the results to
+    max_disk_bytes : int (optional)
+        Size limit of the directory
+    
     Returns
     -------
-    h : physt.histogram_nd.HistogramND
+    cache : query_cache.ResultCache
+    """
+    if max_bytes is not None:
+        result_cache.max_bytes = max_bytes
+    if directory is not None:
+        result_cache.directory = directory
+    if max_disk_bytes is not None:
+        result_cache.max_disk_bytes = max_disk_bytes
+    return result_cache
+    
+    
+def configure_image_cache(directory=None, max_bytes=None):
+    """Change the directory or size limit of the image cache.
+    
+    Returns
+    -------
+    cache : query_cache.ImageCache
+    """
+    if directory is not None:
+        image_cache.directory = directory
+    if max_bytes is not None:
+        image_cache.max_bytes = max_bytes
+    return image_cache
+    
+    
+def query_key(id=None, address=None, altitude_range=None, greenery_range=None,
+              year=None, month=None, hour=None, axes=None):
+    """Hashable key of a query (arguments of get_temperature_data).
+
+    Equivalent queries map to the same key (in the order of
+    _get_temperature_data arguments).
     """
-    path = os.path.join("data", "{0}.json".format(id))
-    return load_json(path)
+    return (id or None, address or None,
+            tuple(altitude_range) if altitude_range else None,
+            tuple(greenery_range) if greenery_range else None,
+            year or None, month or None, hour,
+            tuple(axes) if axes else None)
     
     
 def get_temperature_data(id=None, address=None, altitude_range=None, greenery_range=None,
@@ -140,11 +440,13 @@ def get_temperature_data(id=None, address=None, altitude_range=None, greenery_ra
                          axes=None):
     """Get a histogram based on various criteria.
     
+    The results are cached (see result_cache), treat them as read-only.
+    
     Parameters
     ----------
     id : str
     year : int
-        In range 2013..2015
+        Any year (frequencies are zero outside the measured years)
     month : int
     hour : int
     address : str
@@ -155,8 +457,19 @@ def get_temperature_data(id=None, address=None, altitude_range=None, greenery_ra
     
     Returns
     -------
-    h : physt.histogram_base.HistogramBase
+    h : histogram_data.Histogram
+        Convert with to_physt() for physt functionality
     """
+    key = query_key(id, address, altitude_range, greenery_range, year, month, hour, axes)
+    version = refresh_caches()
+    found, data = result_cache.get(key, version)
+    if not found:
+        data = _get_temperature_data(*key)
+        result_cache.put(key, version, data)
+    return data
+    
+    
+def _get_temperature_data(id, address, altitude_range, greenery_range, year, month, hour, axes):
     # Select data
     if id:
         point = get_point_meta_data(id)
@@ -164,91 +477,40 @@ def get_temperature_data(id=None, address=None, altitude_range=None, greenery_ra
         data = read_data(id)
     else:
         left_texts = []
-        points = find_points(address=address, altitude_range=altitude_range, greenery_range=greenery_range)
         if address:
             left_texts.append(address)
         if altitude_range:
             left_texts.append("{0}-{1} m".format(*altitude_range))
         if greenery_range:
             left_texts.append("{0}-{1} % green".format(*(int(g * 100) for g in greenery_range)))
-        histograms = [read_data(id_) for id_ in points.index]
-        data = sum(histograms)
+        data = sum_histograms(address=address, altitude_range=altitude_range, greenery_range=greenery_range)
         left_text = ", ".join(left_texts)
         
     if not data:
         return None
         
-    # Do the projections / slicing
+    # Do the projections / slicing (views and one sum)
     right_texts = []
+    values = {}
     if year:
-        data = data.select("year", year - 2013)
+        values["year"] = year
         right_texts.append(str(year))
     if month:
-        data = data.select("month", month - 1)
+        values["month"] = month
         right_texts.append(MONTH_NAMES[month-1])
     if hour is not None:
-        data = data.select("hour", hour)
+        values["hour"] = hour
         right_texts.append("{0}:00-{1}:00".format(hour, hour+1))
     right_text = ", ".join(right_texts)
     
-    if axes:
-        data = data.projection(*axes)
+    data = data.query(axes=axes, values=values)
     data.title = " - ".join([t for t in [left_text, right_text] if t])
     return data
 
 
-def plot_temperature_data(histogram, path=None, ax=None, width=1024, height=768, histtype=None):
-    """Plot histogram data.
-    
-    Parameters
-    ----------
-    histogram: physt.histogram_base.HistogramBase
-    path: str (optional)
-    ax: matplotlib.pyplot.Axes (optional)
-    width: int
-    height: int
-    histtype: str (optional)
-    
-    Returns
-    -------
-    None
-        
-    """
-    if not ax:
-        fig, ax = plt.subplots(figsize=(10, height/width * 10))
-    else:
-        fig = ax.figure
-    if histogram is not None:
-        if histtype is None:
-            histtype = ["bar", "image"][histogram.ndim - 1]        
-        histogram.plot(kind=histtype, ax=ax, show_colorbar=False, cmap="Purples")
-        if histogram.axis_names[0] == "month":
-            ax.set_xticks(range(1,13))
-            ax.set_xticklabels(MONTH_NAMES)
-        if histogram.axis_names[0] == "hour":
-            hours = list(range(3, 23, 3))
-            ax.set_xticks(hours)
-            ax.set_xticklabels([str(h) + ":00" for h in hours])
-            minor_locator = MultipleLocator(1)
-            ax.xaxis.set_minor_locator(minor_locator)
-        if histogram.axis_names[0] == "year":
-            ax.set_xticks([2013, 2014, 2015])
-            ax.set_xticklabels([2013, 2014, 2015])
-        if histogram.axis_names[0] == "temperature":
-            minor_locator = MultipleLocator(2)
-            ax.yaxis.set_minor_locator(minor_locator)
-            ax.set_xlabel("Temperature [°C]")
-        if histogram.axis_names[1] == "temperature":
-            minor_locator = MultipleLocator(2)
-            ax.yaxis.set_minor_locator(minor_locator)
-            ax.set_ylabel("Temperature [°C]")
-        ax.set_ylim(-20, 40)
-    else:
-        ax.set_xticks([])
-        ax.set_yticks([])
-        ax.text(0.5, 0.5, 'No sensors fit the criteria', horizontalalignment='center', verticalalignment='center', transform=ax.transAxes, fontdict={"size": 34, "color":"red"})
-
-    if path:
-        fig.tight_layout()
-        fig.savefig(path, dpi=width/10)
-    plt.close(fig)
+def __getattr__(name):
+    # Plotting functions used to live here, they are imported on demand
+    if name in ("plot_temperature_data", "render_temperature_data", "FigureRenderer", "get_renderer"):
+        import plotting
+        return getattr(plotting, name)
+    raise AttributeError("module {0!r} has no attribute {1!r}".format(__name__, name))
@@ -0,0 +1,21 @@
+"""Writing files that readers (in other processes) may have open.
+
+A file is written under a temporary name in the same directory and then
+moved over the old one with os.replace, so readers see either the old
+or the new contents, never a partial file.
+"""
+
+import os
+
+
+# Suffix of files being written (skipped when listing finished files)
+TEMP_SUFFIX = ".tmp"
+
+
+def temp_path(path):
+    """Temporary name to write path under before replacing it.
+
+    Unique per process (so that parallel writers do not clash),
+    in the same directory (so that os.replace is atomic).
+    """
+    return "{0}.{1}{2}".format(path, os.getpid(), TEMP_SUFFIX)
@@ -0,0 +1,226 @@
+"""Lightweight histograms used while answering queries.
+
+A Histogram is just a frequency array with bin edges and axis names.
+Selecting bins creates views and a projection is one sum, so that a query
+allocates only its (small) result. Conversion to physt objects
+(needed for plotting) happens only at the end (see Histogram.to_physt).
+"""
+
+import numpy as np
+
+
+class Histogram:
+    """Frequencies with equidistant bins, aligned to a common grid.
+
+    Attributes
+    ----------
+    frequencies : np.ndarray
+        Possibly a (read-only) view into a larger array
+    edges : list[np.ndarray]
+        Bin edges for each axis
+    axis_names : tuple[str]
+    name : str or None
+    """
+    __slots__ = ("frequencies", "edges", "axis_names", "name", "_title")
+
+    def __init__(self, frequencies, edges, axis_names, name=None, title=None):
+        self.frequencies = frequencies
+        self.edges = list(edges)
+        self.axis_names = tuple(axis_names)
+        self.name = name
+        self._title = title
+
+    @classmethod
+    def from_physt(cls, h):
+        """Wrap frequencies of a physt histogram (without copying them)."""
+        return cls(h.frequencies, h.numpy_bins, h.axis_names, name=h.name)
+
+    @property
+    def title(self):
+        """Plot title (default: name)"""
+        return self._title if self._title is not None else self.name
+
+    @title.setter
+    def title(self, value):
+        self._title = str(value)
+
+    @property
+    def ndim(self):
+        return self.frequencies.ndim
+
+    @property
+    def shape(self):
+        return self.frequencies.shape
+
+    @property
+    def numpy_bins(self):
+        return self.edges
+
+    @property
+    def total(self):
+        return self.frequencies.sum()
+
+    def __repr__(self):
+        return "Histogram({0}, shape={1}, name={2!r})".format(", ".join(self.axis_names), self.shape, self.name)
+
+    def bin_index(self, axis, value):
+        """Index of the bin containing a value (computed, not searched).
+
+        Returns
+        -------
+        index : int or None
+            None if the value is outside the bins.
+        """
+        edges = self.edges[self._get_axis(axis)]
+        index = int(np.floor((value - edges[0]) / (edges[1] - edges[0])))
+        return index if 0 <= index < len(edges) - 1 else None
+
+    def _get_axis(self, axis):
+        if isinstance(axis, str):
+            if axis not in self.axis_names:
+                raise RuntimeError("No axis with such name: {0}, available names: {1}.".format(
+                    axis, ", ".join(self.axis_names)))
+            return self.axis_names.index(axis)
+        if axis < 0 or axis >= self.ndim:
+            raise RuntimeError("No such axis, must be from 0 to {0}".format(self.ndim - 1))
+        return axis
+
+    def select(self, axis, index):
+        """Histogram of one bin in an axis (with one dimension less).
+
+        Parameters
+        ----------
+        axis : str or int
+        index : int
+            Index of the bin (as in numpy)
+
+        Returns
+        -------
+        h : Histogram
+            Its frequencies are a view of the frequencies of this histogram.
+        """
+        return self.query({axis: index})
+
+    def projection(self, *axes):
+        """Sum along all axes but the selected ones (kept in their original order).
+
+        Returns
+        -------
+        h : Histogram
+        """
+        return self.query(axes=axes)
+
+    def query(self, selection=None, axes=None, values=None):
+        """Select bins and project in one step.
+
+        Parameters
+        ----------
+        selection : dict (optional)
+            Axis name (or index) -> bin index
+        axes : list[str] (optional)
+            Axes to project to (all remaining if not set)
+        values : dict (optional)
+            Axis name (or index) -> value, selects the bin containing it.
+            Values outside the bins select nothing (all frequencies are zero).
+
+        Returns
+        -------
+        h : Histogram
+            Only the projection allocates a new frequency array.
+        """
+        index = [slice(None)] * self.ndim
+        remaining = list(range(self.ndim))
+        for axis, bin_index in (selection or {}).items():
+            axis = self._get_axis(axis)
+            index[axis] = bin_index
+            remaining.remove(axis)
+        missing = []    # Axes (in the view) that are empty, they are summed out
+        for axis, value in (values or {}).items():
+            bin_index = self.bin_index(axis, value)
+            axis = self._get_axis(axis)
+            if bin_index is None:
+                index[axis] = slice(0, 0)
+                missing.append(axis)
+            else:
+                index[axis] = bin_index
+            remaining.remove(axis)
+        frequencies = self.frequencies[tuple(index)]
+        if missing:
+            view_axes = [axis for axis in range(self.ndim) if axis in remaining or axis in missing]
+            frequencies = frequencies.sum(axis=tuple(view_axes.index(axis) for axis in missing))
+        axis_names = [self.axis_names[axis] for axis in remaining]
+        edges = [self.edges[axis] for axis in remaining]
+
+        if axes:
+            keep = []
+            for axis in axes:
+                if axis not in axis_names:
+                    raise RuntimeError("Invalid axis name for projection: " + axis)
+                keep.append(axis_names.index(axis))
+            if len(keep) != len(set(keep)):
+                raise RuntimeError("Duplicate axes in projection")
+            summed = tuple(axis for axis in range(len(axis_names)) if axis not in keep)
+            frequencies = frequencies.sum(axis=summed)
+            axis_names = [name for axis, name in enumerate(axis_names) if axis in keep]
+            edges = [e for axis, e in enumerate(edges) if axis in keep]
+        return Histogram(frequencies, edges, axis_names, name=self.name)
+
+    def __add__(self, other):
+        """Sum of two histograms, the bins are extended to cover both."""
+        if not isinstance(other, Histogram):
+            return NotImplemented
+        edges = [union_edges([a, b]) for a, b in zip(self.edges, other.edges)]
+        shape = tuple(len(e) - 1 for e in edges)
+        frequencies = np.zeros(shape, dtype=np.result_type(self.frequencies, other.frequencies))
+        for h in (self, other):
+            frequencies[_placement(h.edges, edges)] += h.frequencies
+        return Histogram(frequencies, edges, self.axis_names)
+
+    def __radd__(self, other):
+        # sum() starts with 0
+        if isinstance(other, int) and other == 0:
+            return self
+        return NotImplemented
+
+    def to_physt(self):
+        """Equivalent physt histogram (Histogram1D, Histogram2D or HistogramND).
+
+        Returns
+        -------
+        h : physt.histogram_base.HistogramBase
+        """
+        from physt.histogram1d import Histogram1D
+        from physt.histogram_nd import HistogramND, Histogram2D
+        from histogram_store import make_binning
+        frequencies = np.array(self.frequencies)
+        binnings = [make_binning(e) for e in self.edges]
+        if self.ndim == 1:
+            h = Histogram1D(binnings[0], frequencies, errors2=frequencies.copy(),
+                            axis_name=self.axis_names[0], name=self.name)
+        elif self.ndim == 2:
+            h = Histogram2D(binnings, frequencies, errors2=frequencies.copy(),
+                            axis_names=list(self.axis_names), name=self.name)
+        else:
+            h = HistogramND(self.ndim, binnings, frequencies, errors2=frequencies.copy(),
+                            axis_names=list(self.axis_names), name=self.name)
+        if self._title is not None:
+            h.title = self._title
+        return h
+
+
+def union_edges(edges_list):
+    """Equidistant edges spanning all of the given (aligned) edges."""
+    bin_width = edges_list[0][1] - edges_list[0][0]
+    first_edge = min(e[0] for e in edges_list)
+    last_edge = max(e[-1] for e in edges_list)
+    bin_count = int(round((last_edge - first_edge) / bin_width))
+    return first_edge + bin_width * np.arange(bin_count + 1)
+
+
+def _placement(edges, target_edges):
+    # Index of the sub-array of target_edges corresponding to edges
+    index = []
+    for e, target in zip(edges, target_edges):
+        offset = int(round((e[0] - target[0]) / (target[1] - target[0])))
+        index.append(slice(offset, offset + len(e) - 1))
+    return tuple(index)
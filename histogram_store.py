@@ -0,0 +1,309 @@
+"""Binary store keeping histograms of all sensors in one dense array.
+
+The store is a directory containing:
+
+* frequencies.npy - int64 array of shape (sensor, year, month, hour, temperature)
+* header.json - sensor ids (in the order of the first axis), axis names and bin edges
+* prefix_<column>.npy + prefix_<column>.json (optional) - cumulative sums of the
+  histograms with sensors sorted by a meta-data column (see write_prefix_sums)
+
+All sensors share the same bin edges, the frequency array is memory-mapped
+when read. physt is imported only when histogram objects are created.
+"""
+
+import glob
+import json
+import os
+
+import numpy as np
+
+from file_utils import temp_path
+from histogram_data import Histogram, union_edges
+
+
+AXIS_NAMES = ("year", "month", "hour", "temperature")
+FREQUENCIES_FILE = "frequencies.npy"
+HEADER_FILE = "header.json"
+PREFIX_FILE = "prefix_{0}.npy"
+PREFIX_HEADER_FILE = "prefix_{0}.json"
+
+
+class HistogramStore:
+    """Read access to a histogram store.
+
+    Attributes
+    ----------
+    ids : list
+        Sensor ids in the order of the first axis of frequencies
+    index : dict
+        Sensor id -> position in the first axis of frequencies
+    frequencies : np.ndarray
+        (memory-mapped) array of shape (sensor, year, month, hour, temperature)
+    edges : list[np.ndarray]
+        Bin edges for each of the histogram axes
+    axis_names : tuple[str]
+    """
+    def __init__(self, path, mmap_mode="r"):
+        with open(os.path.join(path, HEADER_FILE), encoding="utf-8") as f:
+            header = json.load(f)
+        self.path = path
+        self.ids = header["ids"]
+        self.index = {id: i for i, id in enumerate(self.ids)}
+        self.axis_names = tuple(header["axis_names"])
+        self.edges = [np.asarray(e, dtype=float) for e in header["edges"]]
+        self.frequencies = np.load(os.path.join(path, FREQUENCIES_FILE), mmap_mode=mmap_mode)
+
+    def __contains__(self, id):
+        return id in self.index
+
+    def __len__(self):
+        return len(self.ids)
+
+    def aggregate(self, rows):
+        """Sum of histograms of selected sensors.
+
+        One reduction with a 0/1 weight per sensor: the memory-mapped
+        frequencies are streamed, not copied (as fancy indexing would).
+
+        Parameters
+        ----------
+        rows : array_like
+            Positions of sensors along the first axis of frequencies
+
+        Returns
+        -------
+        h : histogram_data.Histogram
+        """
+        weights = np.zeros(len(self), dtype=np.int64)
+        weights[np.asarray(rows, dtype=np.intp)] = 1
+        frequencies = (weights @ self.frequencies.reshape(len(self), -1)).reshape(self.frequencies.shape[1:])
+        return Histogram(frequencies, self.edges, self.axis_names)
+
+    def histogram(self, id):
+        """Histogram of one sensor.
+
+        Returns
+        -------
+        h : physt.histogram_nd.HistogramND
+        """
+        return make_histogram(np.array(self.frequencies[self.index[id]]), self.edges,
+                              name=id, axis_names=self.axis_names)
+
+    def view(self, id):
+        """Histogram of one sensor, without reading its frequencies.
+
+        Returns
+        -------
+        h : histogram_data.Histogram
+            Frequencies are a view of the memory-mapped array.
+        """
+        return Histogram(self.frequencies[self.index[id]], self.edges, self.axis_names, name=id)
+
+    def has_prefix_sums(self, column):
+        return os.path.exists(os.path.join(self.path, PREFIX_HEADER_FILE.format(column)))
+
+    def prefix_sums(self, column, mmap_mode="r"):
+        """Prefix sums along a meta-data column (see write_prefix_sums).
+
+        Returns
+        -------
+        prefix_sums : PrefixSums
+        """
+        with open(os.path.join(self.path, PREFIX_HEADER_FILE.format(column)), encoding="utf-8") as f:
+            header = json.load(f)
+        sums = np.load(os.path.join(self.path, PREFIX_FILE.format(column)), mmap_mode=mmap_mode)
+        return PrefixSums(header["ids"], header["keys"], sums, self.edges, self.axis_names)
+
+
+class PrefixSums:
+    """Cumulative histograms of sensors sorted by a meta-data value.
+
+    The sum of histograms of all sensors with the value in a closed range
+    is a difference of two rows, independent of the number of sensors.
+
+    Attributes
+    ----------
+    ids : list
+        Sensor ids sorted by the value
+    keys : np.ndarray
+        Sorted values
+    sums : np.ndarray
+        (memory-mapped) array, sums[i] is the sum of the first i sensors
+    """
+    def __init__(self, ids, keys, sums, edges, axis_names=AXIS_NAMES):
+        self.ids = ids
+        self.keys = np.asarray(keys, dtype=float)
+        self.sums = sums
+        self.edges = edges
+        self.axis_names = axis_names
+
+    def range_sum(self, min_value, max_value):
+        """Sum of histograms of sensors with min_value <= value <= max_value.
+
+        Returns
+        -------
+        h : histogram_data.Histogram or None
+            None if there is no sensor in the range.
+        """
+        start, stop = self._bounds(min_value, max_value)
+        if stop <= start:
+            return None
+        frequencies = self.sums[stop] - self.sums[start]
+        return Histogram(frequencies, self.edges, self.axis_names)
+
+    def _bounds(self, min_value, max_value):
+        start = int(np.searchsorted(self.keys, min_value, side="left"))
+        stop = int(np.searchsorted(self.keys, max_value, side="right"))
+        return start, stop
+
+
+def make_binning(edges):
+    """Adaptive physt binning equivalent to the one used in JSON files.
+
+    Parameters
+    ----------
+    edges : np.ndarray
+        Equidistant bin edges
+
+    Returns
+    -------
+    binning : physt.binnings.FixedWidthBinning
+    """
+    from physt.binnings import FixedWidthBinning
+    bin_width = edges[1] - edges[0]
+    times_min = int(np.floor(edges[0] / bin_width))
+    return FixedWidthBinning(bin_width=bin_width, bin_count=len(edges) - 1,
+                             bin_times_min=times_min,
+                             bin_shift=edges[0] - times_min * bin_width,
+                             adaptive=True)
+
+
+def make_histogram(frequencies, edges, name=None, axis_names=AXIS_NAMES, **kwargs):
+    """Wrap a frequency array with equidistant edges in a physt histogram.
+
+    Other keyword arguments become meta data of the histogram.
+
+    Returns
+    -------
+    h : physt.histogram_nd.HistogramND
+    """
+    from physt.histogram_nd import HistogramND
+    # axis_names as a list, the same as in histograms loaded from JSON,
+    # so that they survive adding both together
+    kwargs.update(name=name, axis_names=list(axis_names))
+    return HistogramND(len(edges), [make_binning(e) for e in edges], frequencies,
+                       errors2=frequencies.copy(), **kwargs)
+
+
+def write_store(histograms, path, edges=None):
+    """Write a list of histograms into a store.
+
+    Parameters
+    ----------
+    histograms : list[physt.histogram_nd.HistogramND]
+        4D histograms with bins of equal width aligned to a common grid
+        (as created by prepare.create_histogram). Their names are used as ids.
+    path : str
+        Directory of the store (automatically created)
+        Prefix sums of its previous content are removed.
+    edges : list[np.ndarray] (optional)
+        Canonical bin layout of the store (see prepare.canonical_edges),
+        extended only if some data are outside. By default, the bins span
+        exactly the data.
+
+    Returns
+    -------
+    path : str
+    """
+    histograms = list(histograms)
+    if not histograms:
+        raise RuntimeError("Cannot create a store without histograms.")
+    os.makedirs(path, exist_ok=True)
+
+    # Prefix sums of previous content would not match
+    for pattern in (PREFIX_HEADER_FILE, PREFIX_FILE):
+        for prefix_path in glob.glob(os.path.join(path, pattern.format("*"))):
+            os.remove(prefix_path)
+
+    # Shared edges span all histograms
+    edges = [union_edges([h.numpy_bins[axis] for h in histograms] + ([edges[axis]] if edges else []))
+             for axis in range(len(AXIS_NAMES))]
+
+    # Written to new files that replace the old ones, readers may still have them memory-mapped
+    shape = (len(histograms),) + tuple(len(e) - 1 for e in edges)
+    frequencies_path = temp_path(os.path.join(path, FREQUENCIES_FILE))
+    frequencies = np.lib.format.open_memmap(frequencies_path, mode="w+", dtype=np.int64, shape=shape)
+    for i, h in enumerate(histograms):
+        offsets = [int(round((h.numpy_bins[axis][0] - edges[axis][0]) / (edges[axis][1] - edges[axis][0])))
+                   for axis in range(len(AXIS_NAMES))]
+        target = (i,) + tuple(slice(o, o + n) for o, n in zip(offsets, h.shape))
+        frequencies[target] = h.frequencies
+    frequencies.flush()
+    del frequencies
+
+    header = {
+        "ids": [h.name for h in histograms],
+        "axis_names": list(AXIS_NAMES),
+        "edges": [e.tolist() for e in edges],
+    }
+    _write_json(os.path.join(path, HEADER_FILE), header, replaced=[(frequencies_path, FREQUENCIES_FILE)])
+    return path
+
+
+def write_prefix_sums(path, column, values):
+    """Add prefix sums along a meta-data column to an existing store.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the store
+    column : str
+        Name of the column (used in file names)
+    values : dict
+        Sensor id -> value. Sensors without a (finite) value are left out.
+
+    Returns
+    -------
+    path : str
+        Path of the prefix sum array
+    """
+    store = HistogramStore(path)
+    ids = [id for id in store.ids if id in values and np.isfinite(values[id])]
+    ids.sort(key=lambda id: values[id])
+
+    prefix_path = os.path.join(path, PREFIX_FILE.format(column))
+    shape = (len(ids) + 1,) + store.frequencies.shape[1:]
+    sums_path = temp_path(prefix_path)
+    sums = np.lib.format.open_memmap(sums_path, mode="w+", dtype=np.int64, shape=shape)
+    sums[0] = 0
+    for i, id in enumerate(ids):
+        sums[i + 1] = sums[i] + store.frequencies[store.index[id]]
+    sums.flush()
+    del sums
+
+    header = {
+        "ids": ids,
+        "keys": [float(values[id]) for id in ids],
+    }
+    _write_json(os.path.join(path, PREFIX_HEADER_FILE.format(column)), header,
+                replaced=[(sums_path, PREFIX_FILE.format(column))])
+    return prefix_path
+
+
+def _write_json(path, data, replaced=()):
+    """Replace a header file, after the data files it describes.
+
+    Parameters
+    ----------
+    path : str
+    data : dict
+    replaced : list[(str, str)]
+        Temporary paths of written data files and their names
+        (in the directory of path)
+    """
+    temp = temp_path(path)
+    with open(temp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    for data_path, name in replaced:
+        os.replace(data_path, os.path.join(os.path.dirname(path), name))
+    os.replace(temp, path)
@@ -1,29 +1,34 @@
 #! /usr/bin/env python3
-import subprocess
-import threading
-import sys
 import os
 from pathlib import Path
 
-import matplotlib.pyplot as plt
-from matplotlib.figure import Figure
 # from matplotlib.backends.backend_gtk3cairo import FigureCanvasGTK3Cairo as FigureCanvas
 from gi.repository import Gtk
 from gi.repository import GObject
 from gi.repository import GLib
+from gi.repository import GdkPixbuf
 from physt.io import load_json
 import os
 import gtk
 from time import time
 from data_source import get_point_tree
+from plot_controller import PlotController
 import random
+import click
 
 os.chdir(str(Path(__file__).resolve().parent))
 
 MONTH_NAMES = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
 
 class IdeaWin(Gtk.Window):
-    def __init__(self):
+    def __init__(self, plot_process=False):
+        """
+        Parameters
+        ----------
+        plot_process : bool
+            Render plots to PNG files in a separate process (plot_server)
+            instead of the in-process PlotLoader.
+        """
         GObject.threads_init()
         super().__init__(title="Hot Plots")
         self.x = "hour"
@@ -135,7 +140,14 @@ class IdeaWin(Gtk.Window):
         self.last_slider_move_index = 0
         self.graph_id = 0
         self.run_id = random.randrange(9999, 10000)
-        self.worker_process = None
+        self.pixbuf = None
+        if plot_process:
+            self.plot_controller = PlotController(result_callback=self.on_plot_result)
+            self.plot_loader = None
+        else:
+            from plot_loader import PlotLoader
+            self.plot_loader = PlotLoader(result_callback=self.on_plot_result)
+            self.plot_controller = None
 
         filters_box.pack_start(self.green_max_scale, False, False, 0)
         min_scale.set_digits(0)
@@ -281,31 +293,23 @@ class IdeaWin(Gtk.Window):
             self._plot()
 
     def show_temperature_data(self, **kwargs):
-        args = [sys.executable, 'batch.py']
-        if 'altitude_range' in kwargs:
-            args.extend(['--altitude', '{},{}'.format(*kwargs['altitude_range'])])
-        if 'greenery_range' in kwargs:
-            args.extend(['--greenery', '{},{}'.format(*kwargs['greenery_range'])])
-        if 'id' in kwargs:
-            args.extend(['--id', kwargs['id']])
-        if 'address' in kwargs:
-            args.extend(['--address', kwargs['address']])
-        if 'month' in kwargs:
-            args.extend(['--month', str(kwargs['month'])])
-        if 'hour' in kwargs:
-            args.extend(['--hour', str(kwargs['hour'])])
-        args.extend(['--x', self.x])
-        args.extend(['--y', self.y])
-        args.extend(["--width=640", "--height=480"])
+        query = dict(kwargs)
+        query['axes'] = [self.x, self.y]
         self.graph_id += 1
-        outfile = 'output-{}-{}.png'.format(self.run_id, self.graph_id)
-        args.extend([outfile])
-
-        if self.worker_process:
-            self.worker_process.kill()
 
-        print('exec', args)
-        self.worker_process = worker_process = subprocess.Popen(args)
+        print('plot', self.graph_id, query)
+        if self.plot_loader:
+            self.plot_loader.submit(self.graph_id, query, width=640, height=480)
+        else:
+            outfile = 'output-{}-{}.png'.format(self.run_id, self.graph_id)
+            self.plot_controller.send_command(
+                cmd='plot',
+                request_id=self.graph_id,
+                path=outfile,
+                width=640,
+                height=480,
+                query=query,
+            )
 
         child = self.scrolledwindow.get_child()
         if child:
@@ -313,32 +317,57 @@ class IdeaWin(Gtk.Window):
         self.scrolledwindow.add(self.spinner)
         self.spinner.start()
 
-        def _target():
-            try:
-                worker_process.communicate()
-                print('done', worker_process.returncode, outfile)
-                if worker_process.returncode == 0:
-                    GLib.idle_add(self.show_image, outfile)
-                else:
-                    if os.path.exists(outfile):
-                        os.unlink(outfile)
-            except Exception:
-                if os.path.exists(outfile):
-                    os.unlink(outfile)
-                raise
-
-        threading.Thread(target=_target).start()
+    def on_plot_result(self, data):
+        is_current = data['request_id'] == self.graph_id
+        if data['cmd'] != 'done':
+            # Dropped or failed, a partially written image is not shown
+            outfile = data.get('path')
+            if outfile and os.path.exists(outfile):
+                os.unlink(outfile)
+            if data['cmd'] == 'error':
+                print('plot failed:', data.get('message'))
+                if is_current:
+                    self.show_error(data.get('message'))
+            return
+        if 'pixels' in data:
+            if is_current:
+                self.show_pixels(data['pixels'])
+            return
+        outfile = data['path']
+        if is_current:
+            self.show_image(outfile)
+        elif os.path.exists(outfile):
+            os.unlink(outfile)
+
+    def show_error(self, message):
+        self.spinner.stop()
+        child = self.scrolledwindow.get_child()
+        if child:
+            self.scrolledwindow.remove(child)
+        self.scrolledwindow.add(Gtk.Label('Plot failed: {}'.format(message)))
+        self.show_all()
+
+    def show_pixels(self, pixels):
+        height, width = pixels.shape[:2]
+        # Raw RGBA pixels, no encoding / decoding on the way
+        self.pixbuf = GdkPixbuf.Pixbuf.new_from_bytes(
+            GLib.Bytes.new(pixels.tobytes()), GdkPixbuf.Colorspace.RGB, True, 8, width, height, width * 4)
+        self._show_pixbuf()
 
     def show_image(self, filename):
+        print('show', filename)
+        self.pixbuf = GdkPixbuf.Pixbuf.new_from_file(filename)
+        if os.path.exists(filename):
+            os.unlink(filename)
+        self._show_pixbuf()
+
+    def _show_pixbuf(self):
         child = self.scrolledwindow.get_child()
         if child:
             self.scrolledwindow.remove(child)
-        print('show', filename)
-        self.img = Gtk.Image.new_from_file(filename)
+        self.img = Gtk.Image.new_from_pixbuf(self.pixbuf)
         self.scrolledwindow.add(self.img)
         self.show_all()
-        if os.path.exists(filename):
-            os.unlink(filename)
         self.cmp_button.set_sensitive(True)
 
 
@@ -349,8 +378,8 @@ class IdeaWin(Gtk.Window):
         if child:
             self.comparewindow.remove(child)
 
-        pixbuf = self.img.get_pixbuf()
-        img = Gtk.Image.new_from_pixbuf(pixbuf)
+        # Pixbufs are never modified, both views share the same one
+        img = Gtk.Image.new_from_pixbuf(self.pixbuf)
 
         self.comparewindow.add(img)
         self.show_all()
@@ -373,6 +402,10 @@ class IdeaWin(Gtk.Window):
     def clean_up(self, *args):
         if self.map_controller:
             self.map_controller.send_command_if_open(cmd='stop')
+        if self.plot_controller:
+            self.plot_controller.send_command_if_open(cmd='stop')
+        if self.plot_loader:
+            self.plot_loader.stop()
 
         Gtk.main_quit()
 
@@ -390,8 +423,10 @@ class IdeaWin(Gtk.Window):
         # TODO: replot...
         self._plot()
 
-def main():
-    win = IdeaWin()
+@click.command()
+@click.option("--plot-process", is_flag=True, help="Render plots in a separate process (via PNG files)")
+def main(plot_process):
+    win = IdeaWin(plot_process=plot_process)
     Gtk.main()
 
 if __name__ == "__main__":
@@ -2,42 +2,55 @@ import sys
 import os.path
 import threading
 import json
+import math
 import traceback
 
 from kivy.app import App
-from kivy.garden.mapview import MapView, MapMarker, MarkerMapLayer
+from kivy.garden.mapview import MapView, MapMarker, MarkerMapLayer, MapLayer
 from kivy.clock import Clock
 from kivy.uix.widget import Widget
 from kivy.uix.image import Image
 from kivy.uix.behaviors import ButtonBehavior
 from kivy import graphics
+from kivy.graphics.texture import Texture
 from kivy.properties import NumericProperty, ObjectProperty, ListProperty, \
     AliasProperty, BooleanProperty, StringProperty
 from kivy.core.window import Window
 from kivy.animation import Animation
 from kivy.uix.label import Label
-import pandas
+from kivy.core.text import Label as CoreLabel
+import numpy
 import click
 
+from marker_index import MarkerIndex, project, group_points
+from marker_mesh import disc_meshes
+from map_points import load_map_points, POINTS_FILE, RADIUSES
+from marker_style import MarkerStyle, ColorScale, COLORMAPS, MARKER_SIZE, ACTIVE_BORDER
+
 
 # A big hack: we stretch the longitude (x coord) by a constant that makes "circles" in WGS 84 circular
 # ideally we'd use another projection, but that would take time
 X_STRETCH = 1.531
 
+# Distance (in pixels) from the centre of a marker at which it is hovered or clicked
+HIT_RADIUS = MARKER_SIZE / 2
 
-def arc_params(row, column_name, rpos, mapview):
-    value = row[column_name]
-    if column_name == 'avgtemp':
-        minimum = mapview.min_avg_temp
-        maximum = mapview.max_avg_temp
-        normalized_avgtemp = (value - minimum) / (maximum - minimum)
-        n2 = normalized_avgtemp * 2
-        if normalized_avgtemp < 1/2:
-            return {'rgba': (n2, 0, 1, 1)}
-        else:
-            return {'rgba': (1, 0, 1-n2, 1)}
-    else:
-        return {'rgba': (0, rpos, 0, 1), 'end': 360*value}
+# Up to this zoom, points closer than about CLUSTER_SIZE pixels are shown as one marker
+CLUSTER_MAX_ZOOM = 16
+CLUSTER_SIZE = 2 * HIT_RADIUS
+
+# Markers are created also this far outside of the view (as a fraction of its size),
+# so that small pans do not add or remove any
+VIEW_MARGIN = 0.5
+
+# Columns of markers sent with the point_selected command
+POINT_COLUMNS = ['Adresa', 'difftemp']
+
+# Colour scales of markers by the column shown (colormap, symmetric around zero)
+COLOR_SCALES = {
+    'avgtemp': ('temperature', False),
+    'difftemp': ('difference', True),
+}
 
 
 class CustomMapView(MapView):
@@ -57,49 +70,130 @@ class CustomMapView(MapView):
         self.shade_marker = ShadeMapMarker(lat=0, lon=0, radiuses=self.radiuses)
         self.add_marker(self.shade_marker, layer=shade_layer)
 
-        self.marker_layer = MarkerMapLayer()
+        self.marker_layer = MarkerMeshLayer()
         self.add_layer(self.marker_layer)
 
+        # Marker under the mouse (see MarkerMeshLayer.get_marker) and its tooltip
+        self.tooltip_marker = None
         self.tooltip_widget = None
 
+        # Markers in the marker index and the scale it was built for
+        self.marker_index = None
+        self.indexed_markers = None
+        self.index_scale = None
+
         Window.bind(mouse_pos=self.update_mouse_pos)
 
     def update_mouse_pos(self, window, mouse_pos):
         if not self.get_root_window():
             return
         under_mouse = self.lookup_marker(*mouse_pos)
-        if self.tooltip_widget:
-            if self.tooltip_widget == under_mouse:
+        if self.tooltip_marker is not None:
+            if under_mouse is not None and under_mouse['key'] == self.tooltip_marker['key']:
                 return
-            self.tooltip_widget.close_tooltip()
+            self.close_tooltip()
         Clock.unschedule(self.display_tooltip) # cancel scheduled event since I moved the cursor
-        self.tooltip_widget = under_mouse
-        if self.tooltip_widget:
+        self.tooltip_marker = under_mouse
+        if self.tooltip_marker is not None:
             Clock.schedule_once(self.display_tooltip, 0.05)
 
     def display_tooltip(self, *args):
+        marker = self.tooltip_marker
+        if marker is not None:
+            self.tooltip_widget = Tooltip(marker, color=tuple(self.marker_layer.palette.colors[marker['colors'][2]]))
+            self.marker_layer.add_widget(self.tooltip_widget)
+            self.marker_layer.reposition()
+            self.tooltip_widget.open()
+            self.update_highlighted()
+
+    def close_tooltip(self):
+        if self.tooltip_widget:
+            self.tooltip_widget.close()
+            self.tooltip_widget = None
+        self.tooltip_marker = None
+        self.update_highlighted()
+
+    def update_highlighted(self):
+        # The hovered and the active marker are drawn over the others
+        highlighted = []
         if self.tooltip_widget:
-            self.remove_marker(self.tooltip_widget)
-            self.add_marker(self.tooltip_widget, layer=self.marker_layer)
-            self.tooltip_widget.show_tooltip()
+            highlighted.append(self.tooltip_marker)
+        if self.active_marker is not None:
+            highlighted.append(self.active_marker)
+        self.marker_layer.set_highlighted(highlighted)
 
     def lookup_marker(self, x, y):
-        r2 = 20 ** 2
-        for marker in self.marker_layer.children:
-            if (x - marker.x) ** 2 + (y - marker.y) ** 2 < r2:
-                return marker
+        """Marker at a window position.
+
+        Returns
+        -------
+        marker : dict or None
+            See MarkerMeshLayer.get_marker
+        """
+        if self.marker_layer.markers is None:
+            return None
+        scale, offset_x, offset_y = self.get_window_transform()
+        index = self.get_marker_index(scale)
+        found = index.nearest((x - offset_x) / scale, (y - offset_y) / scale, HIT_RADIUS / scale)
+        if found is not None:
+            return self.marker_layer.get_marker(found)
+
+    def get_view_bbox(self, margin=0):
+        """Visible area in projected coordinates.
+
+        Returns
+        -------
+        left, bottom, right, top : float
+        """
+        scale, offset_x, offset_y = self.get_window_transform()
+        margin_x, margin_y = self.width * margin, self.height * margin
+        return ((self.x - margin_x - offset_x) / scale, (self.y - margin_y - offset_y) / scale,
+                (self.right + margin_x - offset_x) / scale, (self.top + margin_y - offset_y) / scale)
+
+    def get_window_transform(self):
+        """Scale and offsets from projected coordinates (see marker_index.project) to the window."""
+        lats = self.lat, self.lat + 0.01
+        lons = self.lon, self.lon + 0.01
+        (x1, y1), (x2, y2) = (self.get_window_xy_from(lat, lon, zoom=self.zoom) for lat, lon in zip(lats, lons))
+        xs, ys = project(lats, lons)
+        # The projection is conformal, the scale is the same for both axes
+        scale = (x2 - x1) / (xs[1] - xs[0])
+        return scale, x1 - scale * xs[0], y1 - scale * ys[0]
+
+    def get_marker_index(self, scale):
+        """Grid of markers for hit-testing, rebuilt when markers change or the map is zoomed."""
+        markers = self.marker_layer.markers
+        if (self.indexed_markers is not markers
+                or not math.isclose(scale, self.index_scale, rel_tol=1e-6)):
+            self.indexed_markers = markers
+            self.marker_index = MarkerIndex(markers['x'], markers['y'], HIT_RADIUS / scale)
+            self.index_scale = scale
+        return self.marker_index
+
+    def on_touch_down(self, touch):
+        # Markers are found in the index, not by dispatching the touch to each of them
+        if (self.collide_point(*touch.pos) and not touch.is_mouse_scrolling
+                and not (touch.is_double_tap and self.double_tap_zoom)):
+            marker = self.lookup_marker(*touch.pos)
+            if marker is not None and marker['count'] > 1:
+                self.zoom = min(self.zoom + 2, CLUSTER_MAX_ZOOM + 1)
+                self.center_on(marker['lat'], marker['lon'])
+                return True
+            if marker is not None:
+                if self.active_marker is not None and self.active_marker['key'] == marker['key']:
+                    self.set_active_marker(None)
+                else:
+                    self.set_active_marker(marker)
+                return True
+        return super().on_touch_down(touch)
 
     def set_active_marker(self, marker):
-        if self.active_marker:
-            self.active_marker.set_active(False)
-            self.shade_marker.active = False
         self.active_marker = marker
-        if marker:
-            marker.set_active(True)
-            self.shade_marker.lat = marker.lat
-            self.shade_marker.lon = marker.lon
-            data = marker.row.to_dict()
-            data['location'] = marker.row.name
+        if marker is not None:
+            self.shade_marker.lat = marker['lat']
+            self.shade_marker.lon = marker['lon']
+            data = {name: marker[name] for name in POINT_COLUMNS + list(self.marker_layer.columns)}
+            data['location'] = marker['lat'], marker['lon']
             send_command(
                 cmd='point_selected',
                 row=data,
@@ -108,6 +202,7 @@ class CustomMapView(MapView):
         else:
             self.shade_marker.active = False
         self.shade_marker.reposition()
+        self.update_highlighted()
 
     def send_position(self, *args):
         send_command(
@@ -164,8 +259,11 @@ class ShadeMapMarker(MapMarker):
 
 
 class Tooltip(Widget):
-    def __init__(self, marker, **kwargs):
+    def __init__(self, marker, color, **kwargs):
         super().__init__(**kwargs)
+        # Position of the marker in projected and window coordinates
+        self.point = marker['x'], marker['y']
+        self.anchor = 0, 0
         with self.canvas.before:
             graphics.PushMatrix()
             self.translation = graphics.Translate(0, 0)
@@ -174,17 +272,17 @@ class Tooltip(Widget):
             graphics.StencilUse()
             graphics.Color(1, 1, 1/2, 0.8)
             self.bg_rect = graphics.Rectangle(size=(100, 100))
-            graphics.Color(*marker.outer_ring_color)
+            graphics.Color(*color)
             graphics.Ellipse(pos=(8, 8), size=(10, 10))
             graphics.PopMatrix()
             graphics.Color(0, 0, 0, 1)
 
         self.label = Label(
-            text='[b]{}[/b]'.format(marker.row['Adresa']), markup=True,
+            text='[b]{}[/b]'.format(marker['Adresa']), markup=True,
             pos=(5, 5), color=(0, 0, 0, 1),
         )
         self.label2 = Label(
-            text='{:+.2f}°C from average'.format(marker.row['difftemp']),
+            text='{:+.2f}°C from average'.format(marker['difftemp']),
             pos=(5, 5), color=(0, 0, 0, 1),
         )
         self.add_widget(self.label)
@@ -204,6 +302,7 @@ class Tooltip(Widget):
     def close(self):
         sz = self.stencil_rect.size[0]
         anim = Animation(size=(sz, 0), duration=0.1)
+        anim.bind(on_complete=lambda *args: self.parent and self.parent.remove_widget(self))
         anim.start(self.stencil_rect)
 
     def resize_text(self, *args):
@@ -223,116 +322,167 @@ class Tooltip(Widget):
 
     def reposition(self, *args):
         lw, lh = self.label.texture_size
-        parent = self.parent
-        if parent:
-            x = parent.x + 8
-            y = parent.y + 15
-            self.translation.xy = x, y
-            self.label.pos = x + 5, y + 3 + self.label2.texture_size[1]
-            self.label2.pos = x + 5 + lh, y + 3
+        x = self.anchor[0] + 8
+        y = self.anchor[1] + 15
+        self.translation.xy = x, y
+        self.label.pos = x + 5, y + 3 + self.label2.texture_size[1]
+        self.label2.pos = x + 5 + lh, y + 3
 
     def collide_point(self, x, y):
         return False
 
 
-class CustomMapMarker(MapMarker):
-    def __init__(self, *args, row, radiuses, columns, mapview, **kwargs):
-        self.row = row
-        self.radiuses = radiuses
-        self.columns = columns
-        self.lat, self.lon = row.name
-        super().__init__(*args, **kwargs)
-        self.anchor_x = 0
-        self.anchor_y = 0
-        self.radius = 20
-        self.size = self.radius * 2, self.radius * 2
-        self.active = False
-        self.tooltip = None
+class Palette:
+    """Colours of mesh vertices, as texels of a texture.
 
-        self.canvas.clear()
+    Texture coordinates of a vertex select its colour.
+    """
+    WIDTH = 256
 
-        with self.canvas.after:
+    def __init__(self, colors):
+        self.colors = numpy.asarray(colors)
+        self.rows = max(1, -(-len(self.colors) // self.WIDTH))
+        data = numpy.zeros((self.rows * self.WIDTH, 4), dtype=numpy.uint8)
+        data[:len(self.colors)] = numpy.round(self.colors * 255)
+        self.texture = Texture.create(size=(self.WIDTH, self.rows), colorfmt='rgba')
+        self.texture.mag_filter = 'nearest'
+        self.texture.min_filter = 'nearest'
+        self.texture.blit_buffer(data.tobytes(), colorfmt='rgba', bufferfmt='ubyte')
+
+    def tex_coords(self, indices):
+        """Texture coordinates (u, v) of colours."""
+        indices = numpy.asarray(indices)
+        return (indices % self.WIDTH + 0.5) / self.WIDTH, (indices // self.WIDTH + 0.5) / self.rows
+
+
+class MarkerMeshLayer(MapLayer):
+    """Markers of all points, drawn by a few meshes.
+
+    Vertices are computed relative to an origin (in pixels at the current
+    scale of the map), so panning only moves all of them by one Translate.
+    They are computed again when the map is zoomed or the markers change.
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # See set_markers and set_style
+        self.markers = None
+        self.positions = {}     # Key -> position in markers
+        self.columns = []
+        self.style = None
+        self.palette = None
+        self.highlighted = []
+        self.origin = 0, 0
+        self.scale = None
+        self.labels = {}    # Count -> texture
+
+        with self.canvas:
             graphics.PushMatrix()
             self.translation = graphics.Translate(0, 0)
-
-            self.border_color = graphics.Color(0, 0, 0, 0.3)
-            sz = self.size[0] + 2
-            hsz = -sz/2
-            graphics.Ellipse(size=(sz, sz), pos=(hsz, hsz))
-
-            self.outer_ring_color = None
-            n = len(columns)
-            for pos, r in enumerate(reversed(columns)):
-                value = self.row[str(r)]
-                rpos = (n - pos) / n
-                params = arc_params(row, r, rpos, mapview)
-                sz = self.size[0] / n * (n - pos)
-                hsz = -sz/2
-                graphics.Color(1-rpos/20, 1-rpos/20, 1, 1)
-                graphics.Ellipse(size=(sz, sz), pos=(hsz, hsz))
-                if value:
-                    graphics.Color(*params['rgba'])
-                    graphics.Ellipse(size=(sz, sz), pos=(hsz, hsz), angle_end=params.get('end', 360))
-                if self.outer_ring_color is None:
-                    self.outer_ring_color = params['rgba']
+            graphics.Color(1, 1, 1, 1)
+            self.meshes = graphics.InstructionGroup()
+            self.overlay = graphics.InstructionGroup()
             graphics.PopMatrix()
-        self.bind(pos=self.reposition)
-        self.set_active(False)
-
-    def close_tooltip(self):
-        if self.tooltip:
-            self.tooltip.close()
 
-    def show_tooltip(self):
-        if not self.tooltip:
-            self.tooltip = Tooltip(self)
-            self.add_widget(self.tooltip)
-            self.reposition()
-        self.tooltip.open()
+    def set_style(self, style):
+        """Change colours and sizes of discs (see marker_style.MarkerStyle)."""
+        self.style = style
+        self.palette = Palette(style.colors)
+        self.scale = None
+        self.reposition()
 
-    def on_touch_down(self, touch):
-        if self.collide_point(touch.x, touch.y):
-            mapview = self.get_mapview()
-            if mapview is None:
-                return
-            if self.active:
-                mapview.set_active_marker(None)
-            else:
-                mapview.remove_widget(self)
-                mapview.add_marker(self, layer=mapview.marker_layer)
-                mapview.set_active_marker(self)
-            return True
-
-    def set_active(self, active):
-        self.canvas.before.clear()
-        self.active = active
+    def set_markers(self, markers, columns):
+        """Change the markers drawn.
+
+        Parameters
+        ----------
+        markers : dict
+            Arrays of positions (x, y projected), counts of points, values
+            of columns, keys, and angles and colours of the discs
+            of the markers (see marker_style.MarkerStyle.discs)
+        columns : list[str]
+        """
+        self.markers = markers
+        self.positions = {key: i for i, key in enumerate(markers['key'])}
+        self.columns = columns
+        if len(markers['key']):
+            self.origin = markers['x'].mean(), markers['y'].mean()
+        self.scale = None
         self.reposition()
-        if active:
-            self.border_color.rgba = 0, 0, 0, 0.5
-        else:
-            self.border_color.rgba = 0, 0, 0, 0.1
 
-    def collide_point(self, x, y):
-        mapview = self.get_mapview()
-        if mapview is None:
+    def get_marker(self, position):
+        """Values of one of the markers as plain Python objects.
+
+        Returns
+        -------
+        marker : dict
+        """
+        return {name: values[position].tolist() if isinstance(values[position], (numpy.generic, numpy.ndarray))
+                else values[position]
+                for name, values in self.markers.items()}
+
+    def set_highlighted(self, markers):
+        """Draw some markers (see get_marker) over the others."""
+        self.highlighted = markers
+        if self.scale is not None:
+            self.build_overlay()
+
+    def reposition(self):
+        mapview = self.parent
+        if mapview is None or self.markers is None or self.style is None:
             return
-        lat, lon = mapview.get_window_xy_from(self.lat, self.lon, zoom=mapview.zoom)
-        x -= self.pos[0]
-        y -= self.pos[1]
-        return x**2 + y**2 < self.radius ** 2
-
-    def get_mapview(self):
-        mapview = self
-        while not isinstance(mapview, CustomMapView):
-            mapview = mapview.parent
-            if mapview is None:
-                return
-        return mapview
-
-    def reposition(self, *args):
-        self.translation.xy = self.pos
-        if self.tooltip:
-            self.tooltip.reposition()
+        scale, offset_x, offset_y = mapview.get_window_transform()
+        if self.scale is None or not math.isclose(scale, self.scale, rel_tol=1e-6):
+            self.scale = scale
+            self.build_meshes()
+            self.build_overlay()
+        self.translation.xy = offset_x + self.origin[0] * scale, offset_y + self.origin[1] * scale
+        for child in self.children:
+            child.anchor = offset_x + child.point[0] * scale, offset_y + child.point[1] * scale
+            child.reposition()
+
+    def build_meshes(self):
+        self.meshes.clear()
+        self.add_meshes(self.meshes, numpy.arange(len(self.markers['key'])))
+
+    def build_overlay(self):
+        self.overlay.clear()
+        active = self.parent.active_marker if self.parent else None
+        for marker in self.highlighted:
+            position = self.positions.get(marker['key'])
+            if position is not None:
+                border = ACTIVE_BORDER if active is not None and active['key'] == marker['key'] else None
+                self.add_meshes(self.overlay, [position], border)
+
+    def add_meshes(self, group, positions, border=None):
+        """Add meshes drawing some of the markers (positions in markers), with counts of merged points."""
+        angles, colors = self.markers['angles'][positions], self.markers['colors'][positions]
+        if border is not None:
+            colors = colors.copy()
+            colors[:, 0] = border
+        x, y = self.to_local(self.markers['x'][positions], self.markers['y'][positions])
+        count = len(self.style.diameters)
+        tex_u, tex_v = self.palette.tex_coords(colors.ravel())
+        for vertices, indices in disc_meshes(numpy.repeat(x, count), numpy.repeat(y, count),
+                                             numpy.tile(self.style.diameters, len(x)), angles.ravel(),
+                                             tex_u, tex_v):
+            group.add(graphics.Mesh(vertices=vertices.tolist(), indices=indices.tolist(),
+                                    mode='triangles', texture=self.palette.texture))
+
+        counts = self.markers['count'][positions]
+        for x_, y_, count in zip(x[counts > 1], y[counts > 1], counts[counts > 1]):
+            if count not in self.labels:
+                label = CoreLabel(text=str(count), font_size=12, bold=True)
+                label.refresh()
+                self.labels[count] = label.texture
+            label = self.labels[count]
+            group.add(graphics.Color(0, 0, 0, 1))
+            group.add(graphics.Rectangle(texture=label, size=label.size,
+                                         pos=(x_ - label.width / 2, y_ - label.height / 2)))
+            group.add(graphics.Color(1, 1, 1, 1))
+
+    def to_local(self, x, y):
+        # Projected coordinates -> pixels relative to the origin
+        return (x - self.origin[0]) * self.scale, (y - self.origin[1]) * self.scale
 
 
 def send_command(**kwargs):
@@ -347,8 +497,12 @@ class MapViewApp(App):
         self.radiuses = radiuses
         self.columns = columns
 
-        self.min_avg_temp = points['avgtemp'].min()
-        self.max_avg_temp = points['avgtemp'].max()
+        self.style = self.get_style('avgtemp')
+
+        self.point_x, self.point_y = project(points.lat, points.lon)
+        # Markers for each cell size (see get_markers)
+        self.marker_levels = {}
+        self.loaded = False
 
         input_thread = threading.Thread(target=self.do_input)
         input_thread.daemon = True
@@ -364,24 +518,89 @@ class MapViewApp(App):
         args = dict(BRNO)
         args['radiuses'] = self.radiuses
         self.mapview = CustomMapView(**args)
-        self.points_iter = iter(enumerate(self.points.iterrows()))
-        self.add_next_points()
+        self.mapview.marker_layer.set_style(self.style)
+        update_trigger = Clock.create_trigger(self.update_markers)
+        self.mapview.bind(lat=update_trigger, lon=update_trigger, zoom=update_trigger, size=update_trigger)
+        update_trigger()
         self.title = 'Temperature Map'
         return self.mapview
 
-    def add_next_points(self, *args):
-        for n in range(50):
-            try:
-                i, (idx, row) = next(self.points_iter)
-            except StopIteration:
-                print('loaded', file=sys.stderr)
-                send_command(cmd='loaded')
-                return
-            #mark = CustomMapMarker(lon=row['GPS lon'], lat=row['GPS lat'], source='noun_9209_cc_red.png')
-            mark = CustomMapMarker(row=row, radiuses=self.radiuses, columns=self.columns, mapview=self)
-            self.mapview.add_marker(mark, layer=self.mapview.marker_layer)
-        Clock.schedule_once(self.add_next_points, 0)
-        print('{}/{}'.format(i, len(self.points)), file=sys.stderr)
+    def update_markers(self, *args):
+        """Draw markers only for points in (and around) the view, merged at low zoom."""
+        mapview = self.mapview
+        left, bottom, right, top = mapview.get_view_bbox(VIEW_MARGIN)
+        exponent = None
+        if mapview.zoom <= CLUSTER_MAX_ZOOM:
+            scale = mapview.get_window_transform()[0]
+            exponent = int(round(math.log2(CLUSTER_SIZE / scale)))
+        markers = self.get_markers(exponent)
+        x, y = markers['x'], markers['y']
+        inside = (x >= left) & (x <= right) & (y >= bottom) & (y <= top)
+        markers = {name: values[inside] for name, values in markers.items()}
+
+        layer = mapview.marker_layer
+        if layer.markers is None or markers['key'].tolist() != layer.markers['key'].tolist():
+            layer.set_markers(markers, self.columns)
+
+        if not self.loaded:
+            self.loaded = True
+            send_command(cmd='loaded')
+
+    def get_style(self, column, colormap=None):
+        """Style of markers with the outer ring coloured by a column (see COLOR_SCALES)."""
+        default_colormap, symmetric = COLOR_SCALES[column]
+        scale = ColorScale.fit(column, self.points.column(column), colormap or default_colormap, symmetric)
+        return MarkerStyle(self.radiuses, scale)
+
+    def set_style(self, column, colormap=None):
+        """Colour the outer rings of markers by another column (or colormap).
+
+        Colours of all computed markers are updated at once.
+        """
+        self.style = self.get_style(column, colormap)
+        for markers in self.marker_levels.values():
+            self.style.recolor(markers, markers['colors'])
+        # Markers of the layer are copies (of the view), they are set again
+        layer = self.mapview.marker_layer
+        layer.markers = None
+        layer.set_style(self.style)
+        self.update_markers()
+
+    def get_markers(self, exponent=None):
+        """Markers of points merged by cells of a grid (of size 2 ** exponent in projected coordinates).
+
+        Returns
+        -------
+        markers : dict
+            Arrays of mean values of the points of each marker, their mean
+            position (also projected, as x and y), count, address (or the
+            number of addresses), the key of the marker (cell for more
+            points, position of the point otherwise), and angles and
+            colours of its discs (see MarkerStyle.discs).
+            Without exponent, there is one marker per point.
+        """
+        if exponent not in self.marker_levels:
+            points = self.points
+            if exponent is None:
+                cells, labels = None, numpy.arange(len(points))
+            else:
+                cells, labels = group_points(self.point_x, self.point_y, 2.0 ** exponent)
+            count = numpy.bincount(labels)
+            markers = {'count': count}
+            for name, values in [('lat', points.lat), ('lon', points.lon)] + \
+                    [(column, points.column(column)) for column in self.columns + ['difftemp']]:
+                markers[name] = values if exponent is None else numpy.bincount(labels, weights=values) / count
+            markers['x'], markers['y'] = project(markers['lat'], markers['lon'])
+            markers['angles'], markers['colors'] = self.style.discs(markers)
+            first = numpy.full(len(count), len(labels))
+            numpy.minimum.at(first, labels, numpy.arange(len(labels)))
+            markers['Adresa'] = numpy.array([points.address(point) if n == 1 else '{0} addresses'.format(n)
+                                             for n, point in zip(count, first)])
+            markers['key'] = numpy.empty(len(count), dtype=object)
+            markers['key'][:] = [int(point) if n == 1 else (exponent, int(cells[i, 0]), int(cells[i, 1]))
+                                 for i, (n, point) in enumerate(zip(count, first))]
+            self.marker_levels[exponent] = markers
+        return self.marker_levels[exponent]
 
     def do_input(self):
         for line in sys.stdin:
@@ -400,17 +619,19 @@ class MapViewApp(App):
             if 'zoom' in data:
                 self.mapview.zoom = int(data['zoom'])
             self.mapview.center_on(float(data['lat']), float(data['lon']))
+        elif cmd == 'style' and data.get('column') in COLOR_SCALES and data.get('colormap') in (None, *COLORMAPS):
+            # Checked here, errors in the main loop would stop the map
+            column, colormap = data['column'], data.get('colormap')
+            Clock.schedule_once(lambda dt: self.set_style(column, colormap))
         else:
             print('map: ignoring command', cmd, data, file=sys.stderr)
 
 
 @click.command()
 def main():
-    radiuses = 0.001, 0.005, 0.01
-    adresace = pandas.read_csv('teplarny-adresace-teplota.csv', sep=';').set_index(['GPS lat', 'GPS lon'])
-    radiuses = [str(r) for r in radiuses]
+    radiuses = RADIUSES
     columns = radiuses + ['avgtemp']
-    points = adresace.loc[:, columns + ['Adresa', 'difftemp']].drop_duplicates()
+    points = load_map_points(POINTS_FILE, radiuses)
     MapViewApp(points, radiuses, columns).run()
 
 if __name__ == '__main__':
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""Points of the temperature map.
+
+Reading the CSV table takes most of the start-up time of the map,
+so the points are kept in a compact binary snapshot next to it
+(a NumPy .npz file with one array per column). The snapshot is
+created automatically and read instead of the table as long as
+the table does not change.
+"""
+
+import os
+
+import click
+import numpy as np
+import pandas as pd
+
+from file_utils import temp_path
+
+
+POINTS_FILE = "teplarny-adresace-teplota.csv"
+RADIUSES = ["0.001", "0.005", "0.01"]
+
+# Change when the arrays in snapshots change
+SNAPSHOT_VERSION = 1
+
+
+class MapPoints:
+    """Map points as columns of arrays.
+
+    Attributes
+    ----------
+    lat : np.ndarray
+    lon : np.ndarray
+    radiuses : list[str]
+        Names of greenery columns (radiuses of their areas)
+    greenery : np.ndarray
+        Shape (points, radiuses)
+    avgtemp : np.ndarray
+    difftemp : np.ndarray
+    addresses : np.ndarray
+        Table of distinct addresses
+    address_codes : np.ndarray
+        Index of the address of each point
+    """
+    def __init__(self, lat, lon, radiuses, greenery, avgtemp, difftemp, addresses, address_codes):
+        self.lat = lat
+        self.lon = lon
+        self.radiuses = list(radiuses)
+        self.greenery = greenery
+        self.avgtemp = avgtemp
+        self.difftemp = difftemp
+        self.addresses = addresses
+        self.address_codes = address_codes
+
+    def __len__(self):
+        return len(self.lat)
+
+    def column(self, name):
+        """Values of a column of the table (greenery, avgtemp or difftemp)."""
+        if name in self.radiuses:
+            return self.greenery[:, self.radiuses.index(name)]
+        if name in ("avgtemp", "difftemp"):
+            return getattr(self, name)
+        raise KeyError(name)
+
+    def address(self, index):
+        return str(self.addresses[self.address_codes[index]])
+
+    @classmethod
+    def from_csv(cls, path=POINTS_FILE, radiuses=RADIUSES):
+        """Read points from the table (rows with the same values are read once)."""
+        radiuses = list(radiuses)
+        table = pd.read_csv(path, sep=";")
+        table = table[~table.duplicated(radiuses + ["avgtemp", "Adresa", "difftemp"])]
+        addresses, address_codes = np.unique(table["Adresa"].values.astype(str), return_inverse=True)
+        return cls(table["GPS lat"].values, table["GPS lon"].values, radiuses, table[radiuses].values,
+                   table["avgtemp"].values, table["difftemp"].values, addresses,
+                   address_codes.ravel().astype(np.int32))
+
+    @classmethod
+    def load(cls, path):
+        """Read a snapshot (see save).
+
+        Returns
+        -------
+        points : MapPoints
+        source : (int, int)
+            Size and modification time of the table it was created from
+        """
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != SNAPSHOT_VERSION:
+                raise ValueError("Unsupported snapshot version.")
+            points = cls(data["lat"], data["lon"], [str(r) for r in data["radiuses"]], data["greenery"],
+                         data["avgtemp"], data["difftemp"], data["addresses"], data["address_codes"])
+            return points, tuple(int(value) for value in data["source"])
+
+    def save(self, path, source=(0, 0)):
+        """Write the arrays to a snapshot file (uncompressed, so that it loads fast)."""
+        temp = temp_path(path)
+        with open(temp, "wb") as f:
+            np.savez(f, version=SNAPSHOT_VERSION, source=np.array(source, dtype=np.int64),
+                     lat=self.lat, lon=self.lon, radiuses=np.array(self.radiuses), greenery=self.greenery,
+                     avgtemp=self.avgtemp, difftemp=self.difftemp, addresses=self.addresses,
+                     address_codes=self.address_codes)
+        os.replace(temp, path)
+
+
+def snapshot_path(path):
+    return os.path.splitext(path)[0] + ".npz"
+
+
+def load_map_points(path=POINTS_FILE, radiuses=RADIUSES):
+    """Points of the map, from the snapshot if it is up to date.
+
+    Otherwise the table is read and the snapshot written again.
+
+    Returns
+    -------
+    points : MapPoints
+    """
+    stat = os.stat(path)
+    source = stat.st_size, stat.st_mtime_ns
+    snapshot = snapshot_path(path)
+    if os.path.exists(snapshot):
+        try:
+            points, snapshot_source = MapPoints.load(snapshot)
+            if snapshot_source == source and points.radiuses == list(radiuses):
+                return points
+        except (OSError, ValueError, KeyError):
+            pass    # Created by another version, it is replaced
+    points = MapPoints.from_csv(path, radiuses)
+    try:
+        points.save(snapshot, source)
+    except OSError:
+        pass    # Read-only directory, the table is read every time
+    return points
+
+
+@click.command()
+@click.argument("path", default=POINTS_FILE)
+def run(path):
+    """Create the snapshot of map points from the table in PATH."""
+    stat = os.stat(path)
+    MapPoints.from_csv(path).save(snapshot_path(path), (stat.st_size, stat.st_mtime_ns))
+    print("Snapshot written to {0}.".format(snapshot_path(path)))
+
+
+if __name__ == "__main__":
+    run()
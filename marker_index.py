@@ -0,0 +1,119 @@
+"""Finding map points near a position on the screen.
+
+Points are kept in projected (Web Mercator) coordinates, see project.
+These map to window coordinates by one scale and an offset, so panning
+the map changes only the offset and the index has to be rebuilt only
+when the scale (zoom) changes.
+"""
+
+import numpy as np
+
+
+# Latitudes beyond these cannot be projected (the same limits as map tiles use)
+MIN_LATITUDE = -85.0511287798
+MAX_LATITUDE = 85.0511287798
+
+
+def project(lat, lon):
+    """Web Mercator coordinates of points.
+
+    Parameters
+    ----------
+    lat : array_like
+    lon : array_like
+
+    Returns
+    -------
+    x, y : np.ndarray
+        The whole world is 0..1 in both, y grows to the north
+        (like window coordinates).
+    """
+    lat = np.radians(np.clip(np.asarray(lat, dtype=float), MIN_LATITUDE, MAX_LATITUDE))
+    x = (np.asarray(lon, dtype=float) + 180.0) / 360.0
+    y = 0.5 + np.log(np.tan(lat) + 1.0 / np.cos(lat)) / (2 * np.pi)
+    return x, y
+
+
+class MarkerIndex:
+    """Uniform grid of points.
+
+    With cells as large as the search radius, a lookup checks
+    only the points in the few cells around the position.
+
+    Attributes
+    ----------
+    x : np.ndarray
+    y : np.ndarray
+    cell_size : float
+    """
+    def __init__(self, x, y, cell_size):
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.cell_size = cell_size
+        cells_x = np.floor(self.x / cell_size).astype(np.int64)
+        cells_y = np.floor(self.y / cell_size).astype(np.int64)
+        # Points sorted by cell, each cell is a slice of them
+        self._order = np.lexsort((cells_y, cells_x))
+        cells = np.stack([cells_x[self._order], cells_y[self._order]], axis=1)
+        starts = np.flatnonzero(np.any(np.diff(cells, axis=0) != 0, axis=1)) + 1
+        starts = np.concatenate([[0], starts]) if len(cells) else starts
+        stops = np.append(starts[1:], len(cells))
+        self._cells = {(int(cells[start, 0]), int(cells[start, 1])): (start, stop)
+                       for start, stop in zip(starts, stops)}
+
+    def __len__(self):
+        return len(self.x)
+
+    def candidates(self, x, y, radius):
+        """Points in the cells overlapping a square around the position.
+
+        Returns
+        -------
+        indices : np.ndarray
+            Indices of the points (in the order they were given)
+        """
+        first_x, last_x = (int(np.floor(c / self.cell_size)) for c in (x - radius, x + radius))
+        first_y, last_y = (int(np.floor(c / self.cell_size)) for c in (y - radius, y + radius))
+        parts = []
+        for cell_x in range(first_x, last_x + 1):
+            for cell_y in range(first_y, last_y + 1):
+                cell = self._cells.get((cell_x, cell_y))
+                if cell:
+                    parts.append(self._order[cell[0]:cell[1]])
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts)
+
+    def nearest(self, x, y, radius):
+        """The point nearest to a position, closer than radius.
+
+        Returns
+        -------
+        index : int or None
+        """
+        indices = self.candidates(x, y, radius)
+        if not len(indices):
+            return None
+        distances = (self.x[indices] - x) ** 2 + (self.y[indices] - y) ** 2
+        best = np.argmin(distances)
+        if distances[best] >= radius ** 2:
+            return None
+        return int(indices[best])
+
+
+def group_points(x, y, cell_size):
+    """Group points by cells of a uniform grid.
+
+    Cells do not depend on the points, so groups of the same cell size
+    are stable when points are added elsewhere (or the map is panned).
+
+    Returns
+    -------
+    cells : np.ndarray
+        (column, row) of each non-empty cell, shape (k, 2)
+    labels : np.ndarray
+        Index of the cell of each point
+    """
+    cells = np.stack([np.floor(np.asarray(x) / cell_size), np.floor(np.asarray(y) / cell_size)], axis=1)
+    cells, labels = np.unique(cells.astype(np.int64).reshape(-1, 2), axis=0, return_inverse=True)
+    return cells, labels.ravel()
@@ -0,0 +1,57 @@
+"""Vertices of map markers, for drawing all of them by a few meshes.
+
+A marker is a stack of (possibly partial) discs around its centre, each
+disc is a fan of triangles. Vertices are (x, y, u, v), the texture
+coordinates select the colour of the disc from a palette texture.
+"""
+
+import numpy as np
+
+
+# Triangles of a full disc
+SEGMENTS = 32
+
+# Vertices of one mesh (its indices are 16-bit)
+MAX_VERTICES = 65535
+
+
+def disc_meshes(x, y, diameters, angles, tex_u, tex_v, segments=SEGMENTS, max_vertices=MAX_VERTICES):
+    """Vertices and indices of meshes drawing discs (in the given order).
+
+    Parameters
+    ----------
+    x, y : np.ndarray
+        Centres of the discs
+    diameters : np.ndarray
+    angles : np.ndarray
+        Where the discs end in degrees (360 for a full disc), clockwise
+        from the top (as in kivy's Ellipse)
+    tex_u, tex_v : np.ndarray
+        Texture coordinates of the colour of each disc
+
+    Returns
+    -------
+    meshes : list[(np.ndarray, np.ndarray)]
+        Vertices (flattened) and indices of each mesh,
+        with at most max_vertices vertices.
+    """
+    count = segments + 2    # Centre and both ends
+    angle = np.radians(np.asarray(angles, dtype=float)[:, np.newaxis] * np.linspace(0, 1, segments + 1))
+    radius = np.asarray(diameters, dtype=float)[:, np.newaxis] / 2
+    vertices = np.empty((len(angle), count, 4), dtype=np.float32)
+    vertices[:, 0, 0] = x
+    vertices[:, 0, 1] = y
+    vertices[:, 1:, 0] = np.asarray(x, dtype=float)[:, np.newaxis] + np.sin(angle) * radius
+    vertices[:, 1:, 1] = np.asarray(y, dtype=float)[:, np.newaxis] + np.cos(angle) * radius
+    vertices[:, :, 2] = np.asarray(tex_u)[:, np.newaxis]
+    vertices[:, :, 3] = np.asarray(tex_v)[:, np.newaxis]
+
+    fan = np.stack([np.zeros(segments, dtype=np.int64), np.arange(1, segments + 1), np.arange(2, segments + 2)],
+                   axis=1).ravel()
+    per_mesh = max_vertices // count
+    meshes = []
+    for start in range(0, len(vertices), per_mesh):
+        part = vertices[start:start + per_mesh]
+        indices = (np.arange(len(part))[:, np.newaxis] * count + fan).ravel()
+        meshes.append((part.ravel(), indices))
+    return meshes
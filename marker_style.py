@@ -0,0 +1,145 @@
+"""Colours and discs of map markers, computed for all markers at once.
+
+A marker is a stack of discs (see marker_mesh), from the bottom: a border
+and for each ring (from the outside) a background and a disc showing
+a value. The outer ring is coloured by a value (like avgtemp) using a
+lookup table, the inner rings are green arcs showing the greenery in
+the radiuses.
+
+All colours are rows of one array (fixed colours first, then the lookup
+table), discs refer to them by index.
+"""
+
+import numpy as np
+
+
+# Diameter of a marker in pixels
+MARKER_SIZE = 40
+
+BORDER_COLOR = 0, 0, 0, 0.1
+ACTIVE_BORDER_COLOR = 0, 0, 0, 0.5
+# Indices of the border colours
+BORDER = 0
+ACTIVE_BORDER = 1
+
+LUT_SIZE = 256
+
+# Colormaps as (position, rgba) stops
+COLORMAPS = {
+    "temperature": [(0.0, (0, 0, 1, 1)), (0.5, (1, 0, 1, 1)), (1.0, (1, 0, 0, 1))],
+    "difference": [(0.0, (0, 0, 1, 1)), (0.5, (1, 1, 1, 1)), (1.0, (1, 0, 0, 1))],
+}
+
+
+def make_lut(stops, size=LUT_SIZE):
+    """Lookup table interpolating colours between stops.
+
+    Parameters
+    ----------
+    stops : list[(float, tuple)]
+        Positions (from 0 to 1) and rgba colours
+    size : int
+
+    Returns
+    -------
+    lut : np.ndarray
+        Shape (size, 4)
+    """
+    positions = [position for position, _ in stops]
+    colors = np.array([color for _, color in stops], dtype=float)
+    t = np.linspace(0, 1, size)
+    return np.stack([np.interp(t, positions, colors[:, channel]) for channel in range(4)], axis=1)
+
+
+class ColorScale:
+    """Colours of values of a column, from a lookup table.
+
+    Attributes
+    ----------
+    column : str
+    minimum : float
+    maximum : float
+    lut : np.ndarray
+        Shape (colours, 4)
+    """
+    def __init__(self, column, minimum, maximum, colormap="temperature", size=LUT_SIZE):
+        self.column = column
+        self.minimum = minimum
+        self.maximum = maximum
+        self.lut = make_lut(COLORMAPS[colormap] if isinstance(colormap, str) else colormap, size)
+
+    @classmethod
+    def fit(cls, column, values, colormap="temperature", symmetric=False):
+        """Scale spanning the values (symmetric around zero if set, for differences)."""
+        minimum, maximum = np.nanmin(values), np.nanmax(values)
+        if symmetric:
+            maximum = max(abs(minimum), abs(maximum))
+            minimum = -maximum
+        return cls(column, minimum, maximum, colormap)
+
+    def indices(self, values):
+        """Indices of the colours of values in the lookup table."""
+        span = (self.maximum - self.minimum) or 1
+        normalized = np.clip((np.asarray(values, dtype=float) - self.minimum) / span, 0, 1)
+        return np.round(np.nan_to_num(normalized) * (len(self.lut) - 1)).astype(np.int64)
+
+
+class MarkerStyle:
+    """Discs of markers with greenery rings and the outer ring coloured by a scale.
+
+    Attributes
+    ----------
+    radiuses : list[str]
+        Greenery columns (from the inside)
+    scale : ColorScale
+    colors : np.ndarray
+        All colours, shape (colours, 4)
+    diameters : np.ndarray
+        Of the discs of a marker (from the bottom)
+    """
+    def __init__(self, radiuses, scale, size=MARKER_SIZE):
+        self.radiuses = list(radiuses)
+        self.scale = scale
+        rings = len(self.radiuses) + 1
+        fixed = [BORDER_COLOR, ACTIVE_BORDER_COLOR]
+        diameters = [size + 2]
+        for pos in range(rings):
+            rpos = (rings - pos) / rings
+            fixed.append((1 - rpos / 20, 1 - rpos / 20, 1, 1))
+            diameters += [size / rings * (rings - pos)] * 2
+        self._greens = len(fixed)
+        fixed += [(0, (rings - pos) / rings, 0, 1) for pos in range(1, rings)]
+        self._lut_offset = len(fixed)
+        self.colors = np.concatenate([np.array(fixed, dtype=float), scale.lut])
+        self.diameters = np.array(diameters)
+
+    def discs(self, markers):
+        """Discs of markers.
+
+        Parameters
+        ----------
+        markers : dict
+            Arrays of values of the scale column and the greenery columns
+
+        Returns
+        -------
+        angles : np.ndarray
+            Where the discs end in degrees, shape (markers, discs)
+        colors : np.ndarray
+            Indices of the colours of the discs, shape (markers, discs)
+        """
+        count = len(markers[self.scale.column])
+        rings = len(self.radiuses) + 1
+        angles = np.full((count, len(self.diameters)), 360.0)
+        colors = np.empty((count, len(self.diameters)), dtype=np.int64)
+        colors[:, 0] = BORDER
+        colors[:, 1::2] = 2 + np.arange(rings)
+        colors[:, 2] = self._lut_offset + self.scale.indices(markers[self.scale.column])
+        for pos, column in enumerate(reversed(self.radiuses), 1):
+            colors[:, 2 + 2 * pos] = self._greens + pos - 1
+            angles[:, 2 + 2 * pos] = 360 * np.nan_to_num(markers[column])
+        return angles, colors
+
+    def recolor(self, markers, colors):
+        """Update colours of the outer rings (in place) for the current scale."""
+        colors[:, 2] = self._lut_offset + self.scale.indices(markers[self.scale.column])
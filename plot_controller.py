@@ -0,0 +1,65 @@
+import threading
+import subprocess
+import json
+import sys
+import traceback
+import io
+
+from gi.repository import GLib
+
+class PlotController:
+    def __init__(self, result_callback=None):
+        self.process = None
+        self.result_callback = result_callback
+        self.start_lock = threading.Lock()
+
+        self.ensure_process()
+
+    def send_command(self, **kwargs):
+        self.ensure_process()
+        json.dump(kwargs, self.process_stdin)
+        print(file=self.process_stdin, flush=True)
+
+    def send_command_if_open(self, **kwargs):
+        with self.start_lock:
+            if self.process:
+                self.send_command(**kwargs)
+
+    def ensure_process(self):
+        if not self.process:
+            self.process = subprocess.Popen(
+                [sys.executable, '-m', 'plot_server'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            )
+            self.process_stdin = io.TextIOWrapper(self.process.stdin)
+            self.process_stdout = io.TextIOWrapper(self.process.stdout)
+
+            thread = threading.Thread(target=self.input_thread, args=(self.process_stdout,))
+            thread.daemon = True
+            thread.start()
+
+        return self.process
+
+    def input_thread(self, stdout):
+        try:
+            while True:
+                try:
+                    line = stdout.readline()
+                    if not line:
+                        return
+                except (BrokenPipeError, EOFError):
+                    return
+                try:
+                    data = json.loads(line)
+                    cmd = data['cmd']
+                    if cmd in ('done', 'dropped', 'error'):
+                        if self.result_callback:
+                            GLib.idle_add(self.result_callback, data)
+                    elif cmd not in ('started', 'stopped'):
+                        print('controller: ignoring line:', data)
+                except Exception:
+                    traceback.print_exc()
+        finally:
+            with self.start_lock:
+                self.process = None
@@ -0,0 +1,57 @@
+"""In-process plotting for the GUI.
+
+Data are loaded and drawn in a background thread into a pixel buffer,
+so that no subprocess, PNG file or image decoding is involved.
+"""
+
+import threading
+import traceback
+
+from gi.repository import GLib
+
+from data_source import get_temperature_data
+from plotting import get_renderer
+from request_queue import LatestRequestQueue
+
+
+class PlotLoader:
+    """Background thread drawing only the most recent of queued requests.
+
+    The result callback is invoked in the GTK main loop with a dict
+    like the messages of plot_server: ``cmd`` is ``done`` (with ``pixels``,
+    see plotting.FigureRenderer.render_rgba), ``dropped`` or ``error``.
+    """
+    def __init__(self, result_callback=None):
+        self.result_callback = result_callback
+        self.queue = LatestRequestQueue(self.dropped)
+
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+    def submit(self, request_id, query, width=1024, height=768):
+        self.queue.submit(dict(request_id=request_id, query=query, width=width, height=height))
+
+    def stop(self):
+        self.queue.stop()
+
+    def dropped(self, request):
+        self.notify(cmd='dropped', request_id=request['request_id'])
+
+    def notify(self, **kwargs):
+        if self.result_callback:
+            GLib.idle_add(self.result_callback, kwargs)
+
+    def run(self):
+        while True:
+            request = self.queue.next_request()
+            if request is None:
+                break
+            try:
+                data = get_temperature_data(**request['query'])
+                pixels = get_renderer().render_rgba(data, width=request['width'], height=request['height'])
+            except Exception as err:
+                traceback.print_exc()
+                self.notify(cmd='error', request_id=request['request_id'], message=str(err))
+            else:
+                self.notify(cmd='done', request_id=request['request_id'], pixels=pixels)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Long-lived plotting worker.
+
+The server reads JSON commands from stdin (one per line) and reports
+results as JSON lines on stdout. As it stays alive between requests,
+the caches in data_source (metadata, point lookups, histograms)
+remain warm and only the first plot pays for loading them.
+
+Commands:
+
+* ``{"cmd": "plot", "request_id": ..., "path": ..., "query": {...}}``
+  renders get_temperature_data(**query) into path (see
+  plotting.render_temperature_data). Optional keys are ``width``
+  and ``height``.
+* ``{"cmd": "refresh"}`` reloads all data before the next plot, also
+  those overwritten in place (see data_source.refresh_caches).
+* ``{"cmd": "stop"}`` terminates the server.
+
+Responses have cmd ``started``, ``done``, ``dropped``, ``error``
+or ``stopped``.
+"""
+
+import sys
+import json
+import threading
+import traceback
+
+import click
+
+from data_source import refresh_caches
+from plotting import render_temperature_data
+from request_queue import LatestRequestQueue
+
+
+# Query arguments that have to be hashable (they feed lru_cache-d functions)
+TUPLE_ARGUMENTS = ("altitude_range", "greenery_range", "axes")
+# Responses come from both the input and the rendering thread
+_output_lock = threading.Lock()
+
+
+def send_command(**kwargs):
+    line = json.dumps(kwargs)
+    with _output_lock:
+        print(line, flush=True)
+
+
+def normalize_query(query):
+    """Convert JSON-decoded query to get_temperature_data arguments.
+
+    Parameters
+    ----------
+    query : dict
+
+    Returns
+    -------
+    kwargs : dict
+    """
+    kwargs = dict(query)
+    for key in TUPLE_ARGUMENTS:
+        if kwargs.get(key) is not None:
+            kwargs[key] = tuple(kwargs[key])
+    return kwargs
+
+
+class PlotServer:
+    """Worker rendering only the most recent of queued requests.
+
+    A request that has not started rendering yet is replaced (and reported
+    as dropped) as soon as a newer one arrives.
+    """
+    def __init__(self):
+        self.queue = LatestRequestQueue(self.dropped)
+        self.refresh = False
+
+    def dropped(self, request):
+        send_command(cmd='dropped', request_id=request.get('request_id'), path=request.get('path'))
+
+    def do_input(self):
+        for line in sys.stdin:
+            try:
+                data = json.loads(line)
+                cmd = data['cmd']
+                if cmd == 'plot':
+                    self.queue.submit(data)
+                elif cmd == 'refresh':
+                    self.refresh = True
+                elif cmd == 'stop':
+                    break
+                else:
+                    print('plot server: ignoring command', cmd, data, file=sys.stderr)
+            except Exception:
+                traceback.print_exc()
+        self.queue.stop()
+
+    def render(self, request):
+        if self.refresh:
+            self.refresh = False
+            refresh_caches(force=True)
+        query = normalize_query(request.get('query', {}))
+        render_temperature_data(request['path'],
+                                width=request.get('width', 1024),
+                                height=request.get('height', 768),
+                                **query)
+
+    def run(self):
+        input_thread = threading.Thread(target=self.do_input)
+        input_thread.daemon = True
+        input_thread.start()
+        send_command(cmd='started')
+
+        while True:
+            request = self.queue.next_request()
+            if request is None:
+                break
+            try:
+                self.render(request)
+            except Exception as err:
+                traceback.print_exc()
+                send_command(cmd='error', request_id=request.get('request_id'),
+                             path=request.get('path'), message=str(err))
+            else:
+                send_command(cmd='done', request_id=request.get('request_id'),
+                             path=request['path'])
+        send_command(cmd='stopped')
+
+
+@click.command()
+def main():
+    PlotServer().run()
+
+
+if __name__ == '__main__':
+    main()
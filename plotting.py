@@ -0,0 +1,252 @@
+"""Plotting of histograms (see data_source for the data).
+
+The figures are drawn by the Agg canvas, independently of the pyplot backend.
+Importing this module selects the Agg backend unless MPLBACKEND is set,
+so it has to be imported before matplotlib (or physt plotting).
+"""
+
+import os
+import sys
+from functools import lru_cache
+
+# Files and pixel buffers only, no need to look for a GUI backend
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import matplotlib
+import matplotlib.cm
+import matplotlib.colors
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.ticker import MultipleLocator
+
+from histogram_data import Histogram
+from data_source import MONTH_NAMES, get_temperature_data, image_cache, refresh_caches, query_key
+
+
+def plot_temperature_data(histogram, path=None, ax=None, width=1024, height=768, histtype=None):
+    """Plot histogram data.
+    
+    Parameters
+    ----------
+    histogram: histogram_data.Histogram or physt.histogram_base.HistogramBase
+    path: str (optional)
+    ax: matplotlib.axes.Axes (optional)
+    width: int
+    height: int
+    histtype: str (optional)
+    
+    Returns
+    -------
+    None
+        
+    See also
+    --------
+    FigureRenderer - faster for repeated plots
+    """
+    if not ax:
+        fig = Figure(figsize=(10, height/width * 10))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(1, 1, 1)
+    else:
+        fig = ax.figure
+    _draw_temperature_data(histogram, ax, histtype)
+    if path:
+        fig.tight_layout()
+        fig.savefig(path, dpi=width/10)
+    if "matplotlib.pyplot" in sys.modules:
+        sys.modules["matplotlib.pyplot"].close(fig)
+
+
+def _draw_temperature_data(histogram, ax, histtype=None):
+    if isinstance(histogram, Histogram):
+        histogram = histogram.to_physt()
+    if histogram is not None:
+        if histtype is None:
+            histtype = ["bar", "image"][histogram.ndim - 1]        
+        histogram.plot(kind=histtype, ax=ax, show_colorbar=False, cmap="Purples")
+        if histogram.axis_names[0] == "month":
+            ax.set_xticks(range(1,13))
+            ax.set_xticklabels(MONTH_NAMES)
+        if histogram.axis_names[0] == "hour":
+            hours = list(range(3, 23, 3))
+            ax.set_xticks(hours)
+            ax.set_xticklabels([str(h) + ":00" for h in hours])
+            minor_locator = MultipleLocator(1)
+            ax.xaxis.set_minor_locator(minor_locator)
+        if histogram.axis_names[0] == "year":
+            edges = np.asarray(histogram.numpy_bins[0])
+            years = np.round((edges[:-1] + edges[1:]) / 2).astype(int)
+            ax.set_xticks(years)
+            ax.set_xticklabels(years)
+        if histogram.axis_names[0] == "temperature":
+            minor_locator = MultipleLocator(2)
+            ax.yaxis.set_minor_locator(minor_locator)
+            ax.set_xlabel("Temperature [°C]")
+        if histogram.axis_names[1] == "temperature":
+            minor_locator = MultipleLocator(2)
+            ax.yaxis.set_minor_locator(minor_locator)
+            ax.set_ylabel("Temperature [°C]")
+        ax.set_ylim(-20, 40)
+    else:
+        ax.set_xticks([])
+        ax.set_yticks([])
+        ax.text(0.5, 0.5, 'No sensors fit the criteria', horizontalalignment='center', verticalalignment='center', transform=ax.transAxes, fontdict={"size": 34, "color":"red"})
+
+
+class FigureRenderer:
+    """Renders histograms into images, reusing figures between calls.
+    
+    One figure is kept for each combination of image size, plot type
+    and axes. If a new histogram has the same bins as the previous one
+    drawn into the figure, only bar heights and colours (or image data)
+    are updated, otherwise the axes are redrawn (see plot_temperature_data).
+    The figures are not managed by pyplot, they are drawn by the Agg canvas.
+    """
+    def __init__(self):
+        self.layouts = {}
+        try:
+            self.cmap = matplotlib.colormaps["Purples"]
+        except AttributeError:    # matplotlib < 3.5
+            self.cmap = matplotlib.cm.get_cmap("Purples")
+        
+    def render(self, histogram, path, width=1024, height=768, histtype=None):
+        """Plot histogram into an image file.
+        
+        Parameters
+        ----------
+        histogram: histogram_data.Histogram or physt.histogram_base.HistogramBase or None
+        path: str
+        width: int
+        height: int
+        histtype: str (optional)
+        """
+        fig = self.draw(histogram, width, height, histtype)
+        if os.path.splitext(path)[1].lower() == ".png":
+            fig.canvas.print_png(path)
+        else:
+            # Format by the extension (svg, pdf, ...), as in plot_temperature_data
+            fig.savefig(path, dpi=width/10)
+        
+    def render_rgba(self, histogram, width=1024, height=768, histtype=None):
+        """Plot histogram into a pixel buffer.
+        
+        Parameters
+        ----------
+        histogram: histogram_data.Histogram or physt.histogram_base.HistogramBase or None
+        width: int
+        height: int
+        histtype: str (optional)
+        
+        Returns
+        -------
+        pixels : np.ndarray
+            uint8 array of shape (height, width, 4), owned by the caller
+        """
+        fig = self.draw(histogram, width, height, histtype)
+        fig.canvas.draw()
+        return np.array(fig.canvas.buffer_rgba())
+        
+    def draw(self, histogram, width=1024, height=768, histtype=None):
+        """Update the figure for histogram (without rendering it).
+        
+        Returns
+        -------
+        fig : matplotlib.figure.Figure
+        """
+        if histogram is None:
+            layout = self._get_layout((width, height, None))
+            if not layout["artists"]:
+                _draw_temperature_data(None, layout["ax"])
+                layout["artists"] = True
+                self._tight_layout(layout["fig"], width)
+        else:
+            if histtype is None:
+                histtype = ["bar", "image"][histogram.ndim - 1]
+            layout = self._get_layout((width, height, histtype, tuple(histogram.axis_names)))
+            bins = [np.asarray(edges) for edges in histogram.numpy_bins]
+            same_bins = (layout["bins"] is not None and len(bins) == len(layout["bins"])
+                         and all(np.array_equal(a, b) for a, b in zip(bins, layout["bins"])))
+            if not (same_bins and self._update(layout, histtype, histogram)):
+                ax = layout["ax"]
+                ax.cla()
+                _draw_temperature_data(histogram, ax, histtype)
+                self._tight_layout(layout["fig"], width)
+                layout["bins"] = bins
+                if histtype == "bar":
+                    layout["artists"] = ax.patches
+                elif histtype == "image":
+                    layout["artists"] = ax.images[0]
+                else:
+                    layout["artists"] = None
+        return layout["fig"]
+        
+    def _get_layout(self, key):
+        layout = self.layouts.get(key)
+        if layout is None:
+            width, height = key[:2]
+            fig = Figure(figsize=(10, height/width * 10), dpi=width/10)
+            FigureCanvasAgg(fig)
+            layout = self.layouts[key] = {"fig": fig, "ax": fig.add_subplot(1, 1, 1),
+                                          "bins": None, "artists": None}
+        return layout
+    
+    def _tight_layout(self, fig, width):
+        # The same layout as of plot_temperature_data (computed before savefig changes dpi)
+        fig.set_dpi(matplotlib.rcParams["figure.dpi"])
+        fig.tight_layout()
+        fig.set_dpi(width / 10)
+        
+    def _update(self, layout, histtype, histogram):
+        # Same as in physt bar / image plots with cmap
+        artists = layout["artists"]
+        data = histogram.frequencies
+        norm = matplotlib.colors.Normalize(0, data.max(), clip=True)
+        if histtype == "bar" and len(artists) == len(data):
+            for rect, value, color in zip(artists, data, self.cmap(norm(data))):
+                rect.set_height(value)
+                rect.set_facecolor(color)
+        elif histtype == "image":
+            artists.set_data(data.T[::-1, :])
+            artists.set_norm(norm)
+        else:
+            return False
+        layout["ax"].set_title(histogram.title or "")
+        return True
+    
+    
+@lru_cache(1)
+def get_renderer():
+    return FigureRenderer()
+
+
+def render_temperature_data(path, width=1024, height=768, histtype=None, use_cache=True, **query):
+    """Plot the result of a query into an image file.
+    
+    Images are cached (see image_cache) by the query, the render parameters
+    and the format (extension of path), repeated requests only copy the file without running matplotlib.
+    
+    Parameters
+    ----------
+    path : str
+    width : int
+    height : int
+    histtype : str (optional)
+    use_cache : bool
+    query : dict
+        Arguments of get_temperature_data
+    
+    Returns
+    -------
+    path : str
+    """
+    # Images of different formats are cached separately
+    key = (query_key(**query), width, height, histtype, os.path.splitext(path)[1].lower())
+    version = refresh_caches()
+    if use_cache and image_cache.get(key, version, path):
+        return path
+    data = get_temperature_data(**query)
+    get_renderer().render(data, path, width=width, height=height, histtype=histtype)
+    if use_cache:
+        image_cache.put(key, version, path)
+    return path
@@ -0,0 +1,88 @@
+"""Precomputed index of measure points for fast filtering.
+
+Points are identified by their position in PointIndex.ids. Range queries
+are binary searches in sorted columns, address lookups are dictionary
+lookups. The results are sorted arrays of positions that can be
+used directly for aggregation (see HistogramStore.aggregate).
+"""
+
+import numpy as np
+
+
+# Meta-data columns that support range queries
+RANGE_COLUMNS = ("vyska", "greenery")
+
+
+class PointIndex:
+    """Sorted columns and address lookup over a fixed set of points.
+
+    Attributes
+    ----------
+    ids : np.ndarray
+        Point ids (object array), positions refer to it
+    addresses : dict
+        Address -> sorted array of positions
+    """
+    def __init__(self, metadata, columns=RANGE_COLUMNS):
+        """
+        Parameters
+        ----------
+        metadata : pd.DataFrame
+            Points (indexed by id) with "Adresa" and the range columns
+        columns : tuple[str]
+        """
+        self.ids = np.asarray(metadata.index.values, dtype=object)
+        self._columns = {}
+        for column in columns:
+            values = metadata[column].values.astype(float)
+            order = np.argsort(values, kind="stable")
+            order = order[~np.isnan(values[order])]     # NaN never matches a range
+            self._columns[column] = (values[order], order)
+        codes, addresses = metadata["Adresa"].factorize()
+        by_code = np.argsort(codes, kind="stable")
+        by_code = by_code[codes[by_code] >= 0]      # Points without an address (code -1)
+        splits = np.searchsorted(codes[by_code], np.arange(1, len(addresses)))
+        self.addresses = dict(zip(addresses, np.split(by_code, splits)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def range_positions(self, column, min_value, max_value):
+        """Positions of points with min_value <= value <= max_value (sorted)."""
+        values, order = self._columns[column]
+        start = np.searchsorted(values, min_value, side="left")
+        stop = np.searchsorted(values, max_value, side="right")
+        return np.sort(order[start:stop])
+
+    def covers(self, column, min_value, max_value):
+        """Whether all points have min_value <= value <= max_value (the range filters nothing)."""
+        values, _ = self._columns[column]
+        if len(values) < len(self.ids):
+            return False    # Points without a value never match a range
+        return not len(values) or (min_value <= values[0] and values[-1] <= max_value)
+
+    def address_positions(self, address):
+        """Positions of points at an address (sorted)."""
+        return self.addresses.get(address, np.empty(0, dtype=np.intp))
+
+    def positions(self, address=None, altitude_range=None, greenery_range=None):
+        """Positions of points matching all the criteria.
+
+        Returns
+        -------
+        positions : np.ndarray
+            Sorted integer array
+        """
+        selections = []
+        if address:
+            selections.append(self.address_positions(address))
+        if altitude_range:
+            selections.append(self.range_positions("vyska", *altitude_range))
+        if greenery_range:
+            selections.append(self.range_positions("greenery", *greenery_range))
+        if not selections:
+            return np.arange(len(self.ids))
+        result = selections[0]
+        for selection in selections[1:]:
+            result = np.intersect1d(result, selection, assume_unique=True)
+        return result
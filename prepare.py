@@ -2,13 +2,55 @@
 """Functions to prepare aggregate data from raw CSV data."""
 
 import os
+import glob
+import json
+import pickle
+import hashlib
+from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import click
 import numpy as np
 import pandas as pd
 from physt import histogramdd
+from physt.io import load_json
+from histogram_store import HistogramStore, HEADER_FILE, make_histogram, write_store, write_prefix_sums
+from data_source import get_all_point_metadata, CSV_FILE, INGESTED_FILE
+from file_utils import temp_path
 
 
-def parse_data_file(path, min_year=2013, max_year=2015, min_temp=-50, max_temp=50):
+# How to read the raw CSV files
+CSV_OPTIONS = dict(delimiter=";", decimal=",", header=None, names=["datetime", "place", "temperature"])
+
+# Formats of timestamps recognized automatically
+DATETIME_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%d.%m.%Y %H:%M:%S", "%d.%m.%Y %H:%M"]
+
+# Columns of parsed data (all returned by default)
+DATA_COLUMNS = ["datetime", "temperature", "id", "year", "month", "hour",
+                "day_of_year", "day_of_week", "second_of_day"]
+
+# Raw data files used when a directory is given as input
+INPUT_PATTERNS = ["*.csv", "*.zip"]
+
+# Where (relative to the output directory) to cache histograms of individual inputs
+PARTIAL_DIR = ".partial"
+MANIFEST_FILE = "manifest.json"
+
+# Axes of the 4D histograms, year and month bins are centered around integers
+HISTOGRAM_AXES = ["year", "month", "hour", "temperature"]
+HISTOGRAM_SHIFTS = [0.5, 0.5, 0.0, 0.0]
+
+# Accepted values (by default), they also define the canonical bins of the store
+YEAR_RANGE = (2013, 2015)
+TEMPERATURE_RANGE = (-50, 50)
+
+# Meta-data columns with precomputed prefix sums (used by range filters)
+PREFIX_SUM_COLUMNS = ("vyska", "greenery")
+
+
+def parse_data_file(path, min_year=YEAR_RANGE[0], max_year=YEAR_RANGE[1],
+                    min_temp=TEMPERATURE_RANGE[0], max_temp=TEMPERATURE_RANGE[1],
+                    datetime_format=None, columns=None):
     """Prepare dataframe from CSV temperature source.
     
     Parameters
@@ -19,6 +61,11 @@ def parse_data_file(path, min_year=2013, max_year=2015, min_temp=-50, max_temp=5
     max_year : int
     min_temp : float
     max_temp : float
+    datetime_format : str (optional)
+        strptime-like format of the timestamps. If not set, one of
+        DATETIME_FORMATS is detected (or pandas guesses it for each value).
+    columns : list (optional)
+        Only these columns are computed and returned (default: all)
     
     Returns
     -------
@@ -27,7 +74,7 @@ def parse_data_file(path, min_year=2013, max_year=2015, min_temp=-50, max_temp=5
     
         datetime         datetime64[ns]
         temperature             float64
-        id                       object
+        id                     category
         year                      int64
         month                     int64
         hour                      int64
@@ -36,20 +83,122 @@ def parse_data_file(path, min_year=2013, max_year=2015, min_temp=-50, max_temp=5
         second_of_day             int64
     """
     
-    data = pd.read_csv(path, delimiter=";", decimal=",", header=None, names=["datetime", "place", "temperature"])
-    data["datetime"] = pd.to_datetime(data["datetime"])
-    data["id"] = data.place.str.extract("(?<=\\\\)(.*)(?=\\\\)", expand=False).str.lower()
-    data["year"] = data.datetime.dt.year
-    data["month"] = data.datetime.dt.month
-    data["hour"] = data.datetime.dt.hour
-    data["day_of_year"] = data.datetime.dt.dayofyear
-    data["day_of_week"] = (data.datetime.dt.dayofweek - 1) % 7 + 1
-    data["second_of_day"] = data.datetime.dt.hour * 3600 + data.datetime.dt.minute * 60 + data.datetime.dt.second
+    data = pd.read_csv(path, **CSV_OPTIONS)
+    return _parse_data(data, min_year=min_year, max_year=max_year, min_temp=min_temp, max_temp=max_temp,
+                       datetime_format=datetime_format, columns=columns)
+    
+    
+def parse_data_chunks(path, chunk_size=1000000, min_year=YEAR_RANGE[0], max_year=YEAR_RANGE[1],
+                      min_temp=TEMPERATURE_RANGE[0], max_temp=TEMPERATURE_RANGE[1],
+                      datetime_format=None, columns=None):
+    """Prepare dataframes from CSV temperature source, reading it in chunks.
+    
+    Only one chunk is kept in memory at a time.
+    
+    Parameters
+    ----------
+    path : str
+        Path to the CSV file (can be a zip file containing a single CSV inside)
+    chunk_size : int
+        Number of rows read at once
+    min_year : int
+    max_year : int
+    min_temp : float
+    max_temp : float
+    datetime_format : str (optional)
+    columns : list (optional)
+    
+    Yields
+    ------
+    data : pd.DataFrame
+        The same columns as in parse_data_file
+    """
+    for data in pd.read_csv(path, chunksize=chunk_size, **CSV_OPTIONS):
+        yield _parse_data(data, min_year=min_year, max_year=max_year, min_temp=min_temp, max_temp=max_temp,
+                          datetime_format=datetime_format, columns=columns)
+        
+        
+def guess_datetime_format(values):
+    """Find the format of timestamps.
+    
+    Parameters
+    ----------
+    values : pd.Series
+        Timestamps as strings
+    
+    Returns
+    -------
+    format : str or None
+        The first of DATETIME_FORMATS matching the first timestamp
+    """
+    values = values.dropna()
+    if not len(values):
+        return None
+    for datetime_format in DATETIME_FORMATS:
+        try:
+            datetime.strptime(values.iloc[0], datetime_format)
+            return datetime_format
+        except ValueError:
+            pass
+    return None
+    
+    
+def _parse_data(data, min_year, max_year, min_temp, max_temp, datetime_format=None, columns=None):
+    """Add derived columns to raw CSV data and clean them up."""
+    if columns is None:
+        columns = DATA_COLUMNS
+    if datetime_format is None:
+        datetime_format = guess_datetime_format(data["datetime"])
+    timestamps = pd.to_datetime(data["datetime"], format=datetime_format)
+    
+    # All time fields from the nanosecond representation
+    ns = timestamps.values.astype("datetime64[ns]")
+    days = ns.astype("datetime64[D]")
+    years = ns.astype("datetime64[Y]")
+    year = years.astype(np.int64) + 1970
+    second_of_day = (ns - days).astype("timedelta64[s]").astype(np.int64)
+    derived = {
+        "year": lambda: year,
+        "month": lambda: ns.astype("datetime64[M]").astype(np.int64) % 12 + 1,
+        "hour": lambda: second_of_day // 3600,
+        "day_of_year": lambda: (days - years.astype("datetime64[D]")).astype(np.int64) + 1,
+        # 1970-01-01 was Thursday
+        "day_of_week": lambda: (days.astype(np.int64) + 2) % 7 + 1,
+        "second_of_day": lambda: second_of_day,
+    }
+    
+    result = pd.DataFrame(index=data.index)
+    for column in DATA_COLUMNS:
+        if column not in columns:
+            continue
+        if column == "datetime":
+            result[column] = timestamps
+        elif column == "temperature":
+            result[column] = data["temperature"]
+        elif column == "id":
+            result[column] = _extract_ids(data["place"])
+        else:
+            result[column] = derived[column]()
 
     # Clean up
-    data = data[(data["temperature"] <= max_temp) & (data["temperature"] >= min_temp)]
-    data = data[(data["year"] <= max_year) & (data["year"] >= min_year)] 
-    return data.drop("place", axis=1)
+    valid = timestamps.notnull().values
+    valid &= (data["temperature"] <= max_temp).values & (data["temperature"] >= min_temp).values
+    valid &= (year <= max_year) & (year >= min_year)
+    result = result[valid]
+    result.attrs["dropped"] = int(len(valid) - valid.sum())
+    return result
+
+
+def _extract_ids(places):
+    """Sensor ids (lower-case) from the place column as a categorical series.
+    
+    The ids are extracted only once for each distinct place.
+    """
+    place_codes, place_uniques = pd.factorize(places)
+    ids = pd.Series(place_uniques).str.extract("(?<=\\\\)(.*)(?=\\\\)", expand=False).str.lower()
+    id_codes, id_uniques = pd.factorize(ids)
+    codes = np.where(place_codes >= 0, id_codes[place_codes], -1)
+    return pd.Categorical.from_codes(codes, id_uniques)
     
     
 def create_histogram(data, id):
@@ -75,6 +224,337 @@ def create_histogram(data, id):
                        axis_names=["year", "month", "hour", "temperature"])
 
 
+def canonical_edges(year_range=YEAR_RANGE, temperature_range=TEMPERATURE_RANGE):
+    """Fixed bins covering all values accepted by parse_data_file.
+    
+    Stores written with this layout (see histogram_store.write_store)
+    do not depend on the data, so histograms from all sources are
+    aligned and bins of any value are found directly.
+    
+    Returns
+    -------
+    edges : list[np.ndarray]
+        Bin edges for year, month, hour and temperature
+    """
+    lows = [year_range[0], 1, 0, temperature_range[0]]
+    highs = [year_range[1], 12, 23, temperature_range[1]]
+    return [np.arange(low, high + 2) - shift for low, high, shift in zip(lows, highs, HISTOGRAM_SHIFTS)]
+    
+    
+def create_histograms(data):
+    """For each sensor in a dataset, create a 4D histogram.
+    
+    All histograms are filled in one pass over the data: each row gets
+    a flat index into the (trimmed) bins of its sensor and all of them
+    are counted at once.
+    
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Dataset with data from different sensors.
+        (as prepared using parse_data_file)
+    
+    Returns
+    -------
+    histograms : OrderedDict
+        Sensor id -> histogram, the same as create_histogram would produce
+    """
+    codes, ids = pd.factorize(data["id"])
+    result = OrderedDict()
+    if not len(ids):
+        return result
+        
+    # Rows without a sensor id (code -1) are not counted
+    valid = codes >= 0
+    codes = codes[valid]
+    
+    # Bins of width 1 (centered around integers for year and month)
+    indices = [np.floor(data[name].values[valid] + shift).astype(np.int64)
+               for name, shift in zip(HISTOGRAM_AXES, HISTOGRAM_SHIFTS)]
+    
+    # Adaptive histograms span only the bins with data of the sensor
+    lows = np.empty((len(ids), len(indices)), dtype=np.int64)
+    highs = np.empty((len(ids), len(indices)), dtype=np.int64)
+    for axis, index in enumerate(indices):
+        lows[:, axis] = index.max()
+        highs[:, axis] = index.min()
+        np.minimum.at(lows[:, axis], codes, index)
+        np.maximum.at(highs[:, axis], codes, index)
+    shapes = highs - lows + 1
+    offsets = np.concatenate([[0], np.cumsum(shapes.prod(axis=1))])
+    
+    flat_index = offsets[codes]
+    stride = np.ones(len(codes), dtype=np.int64)
+    for axis in reversed(range(len(indices))):
+        flat_index += (indices[axis] - lows[codes, axis]) * stride
+        stride *= shapes[codes, axis]
+    counts = np.bincount(flat_index, minlength=offsets[-1])
+    
+    for i, id in enumerate(ids):
+        frequencies = counts[offsets[i]:offsets[i + 1]].reshape(shapes[i])
+        edges = [np.arange(low, low + count + 1) - shift
+                 for low, count, shift in zip(lows[i], shapes[i], HISTOGRAM_SHIFTS)]
+        result[id] = make_histogram(frequencies, edges, bin_width=(1, 1, 1, 1), name=id,
+                                    axis_names=HISTOGRAM_AXES)
+    return result
+    
+    
+def accumulate_histograms(chunks):
+    """Create per-sensor histograms incrementally from a sequence of datasets.
+    
+    The histograms of each chunk are added to the result as soon as
+    the chunk is processed, memory use does not depend on the number of rows.
+    
+    Parameters
+    ----------
+    chunks : Iterable[pd.DataFrame]
+        (as prepared using parse_data_chunks)
+    
+    Returns
+    -------
+    histograms : OrderedDict
+        Sensor id -> histogram, the same as create_histograms would produce
+        for all the chunks concatenated.
+    """
+    return merge_histograms(create_histograms(data) for data in chunks)
+
+
+def merge_histograms(partials):
+    """Sum per-sensor histograms from several sources.
+    
+    Parameters
+    ----------
+    partials : Iterable[dict]
+        Sensor id -> histogram
+    
+    Returns
+    -------
+    histograms : OrderedDict
+        Sensor id -> sum of its histograms
+    """
+    result = OrderedDict()
+    for histograms in partials:
+        for id, histogram in histograms.items():
+            if id in result:
+                result[id] += histogram
+            else:
+                result[id] = histogram
+    return result
+
+
+def find_input_files(inputs):
+    """Expand input arguments to a list of raw data files.
+    
+    Parameters
+    ----------
+    inputs : Iterable[str]
+        Files, glob patterns or directories (all CSV and zip files in them are used)
+    
+    Returns
+    -------
+    paths : list
+        Sorted, without duplicates
+    """
+    result = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for pattern in INPUT_PATTERNS:
+                result.update(glob.glob(os.path.join(item, pattern)))
+        elif glob.has_magic(item):
+            result.update(glob.glob(item))
+        else:
+            result.add(item)
+    return sorted(result)
+
+
+def prepare_input(path, partial_path, chunk_size=0, datetime_format=None,
+                  year_range=YEAR_RANGE, temperature_range=TEMPERATURE_RANGE):
+    """Create per-sensor histograms for one raw data file and save them.
+    
+    Parameters
+    ----------
+    path : str
+        Raw data file
+    partial_path : str
+        Where to pickle the histograms to
+    chunk_size : int
+        If positive, read the file in chunks of this many rows
+    datetime_format : str (optional)
+        Format of timestamps (see parse_data_file)
+    year_range : (int, int)
+        Accepted years (see parse_data_file)
+    temperature_range : (float, float)
+        Accepted temperatures (see parse_data_file)
+    
+    Returns
+    -------
+    counts : dict
+        Numbers of rows used ("rows") and dropped as invalid or outside
+        the ranges ("dropped")
+    """
+    # Only the columns needed for histograms
+    columns = HISTOGRAM_AXES + ["id"]
+    options = dict(min_year=year_range[0], max_year=year_range[1],
+                   min_temp=temperature_range[0], max_temp=temperature_range[1],
+                   datetime_format=datetime_format, columns=columns)
+    counts = {"rows": 0, "dropped": 0}
+    
+    def counted(chunks):
+        for data in chunks:
+            counts["rows"] += len(data)
+            counts["dropped"] += data.attrs.get("dropped", 0)
+            yield data
+    
+    if chunk_size > 0:
+        histograms = accumulate_histograms(counted(parse_data_chunks(path, chunk_size=chunk_size, **options)))
+    else:
+        histograms = accumulate_histograms(counted([parse_data_file(path, **options)]))
+    with open(partial_path, "wb") as f:
+        pickle.dump(histograms, f, pickle.HIGHEST_PROTOCOL)
+    return counts
+
+
+def prepare_inputs(paths, cache_dir, workers=None, chunk_size=0, datetime_format=None,
+                   year_range=YEAR_RANGE, temperature_range=TEMPERATURE_RANGE, counts=None):
+    """Create per-sensor histograms for many raw data files in parallel.
+    
+    Histograms of each file are cached in cache_dir (together with
+    a manifest of file sizes, modification times and parse options),
+    files that have not changed since the last run (and are parsed
+    the same way) are not parsed again.
+    
+    Parameters
+    ----------
+    paths : list
+        Raw data files
+    cache_dir : str
+        Directory for partial results (automatically created)
+    workers : int (optional)
+        Number of worker processes (default: number of CPUs)
+    chunk_size : int
+        If positive, read the files in chunks of this many rows
+    datetime_format : str (optional)
+        Format of timestamps (see parse_data_file)
+    year_range : (int, int)
+        Accepted years (see parse_data_file)
+    temperature_range : (float, float)
+        Accepted temperatures (see parse_data_file)
+    counts : dict (optional)
+        Filled with the numbers of rows used and dropped in all files
+        (see prepare_input)
+    
+    Returns
+    -------
+    histograms : OrderedDict
+        Sensor id -> histogram, merged over all files
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILE)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    
+    # Partial results parsed with other options are stale (lists as read from JSON)
+    options = {"datetime_format": datetime_format, "year_range": list(year_range),
+               "temperature_range": list(temperature_range)}
+    partial_paths = []
+    todo = []
+    for path in paths:
+        key = os.path.abspath(path)
+        entry = _file_state(path)
+        entry["options"] = options
+        entry["partial"] = hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pickle"
+        partial_path = os.path.join(cache_dir, entry["partial"])
+        partial_paths.append(partial_path)
+        cached = {name: value for name, value in manifest.get(key, {}).items() if name != "counts"}
+        if cached != entry or not os.path.exists(partial_path):
+            manifest.pop(key, None)
+            todo.append((key, entry, path, partial_path))
+    
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(key, entry, executor.submit(prepare_input, path, partial_path, chunk_size, datetime_format,
+                                                year_range, temperature_range))
+                   for key, entry, path, partial_path in todo]
+        for key, entry, future in futures:
+            entry["counts"] = future.result()
+            manifest[key] = entry
+            with open(manifest_path, "w", encoding="utf-8") as f:
+                json.dump(manifest, f, indent=2)
+    
+    if counts is not None:
+        for name in ("rows", "dropped"):
+            counts[name] = sum(manifest[os.path.abspath(path)].get("counts", {}).get(name, 0) for path in paths)
+    return merge_histograms(_load_partial(partial_path) for partial_path in partial_paths)
+    
+    
+def _load_partial(path):
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def _file_state(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+
+
+def read_ingested(dir_path="data", output_format="store"):
+    """Raw data files whose data are already in the histograms of one format.
+    
+    Parameters
+    ----------
+    dir_path : str
+    output_format : str
+        "json" or "store", each has its own record
+    
+    Returns
+    -------
+    ingested : dict or None
+        Absolute path -> {"size": ..., "mtime": ...} at the time of ingestion,
+        None if nothing was recorded for the format
+    """
+    path = os.path.join(dir_path, INGESTED_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f).get(output_format)
+
+
+def write_ingested(paths, dir_path="data", output_format="store", append=False):
+    """Record raw data files as ingested into the histograms of one format.
+    
+    Parameters
+    ----------
+    paths : list
+    dir_path : str
+    output_format : str
+        "json" or "store"
+    append : bool
+        Keep the files already recorded (otherwise they are forgotten)
+    """
+    path = os.path.join(dir_path, INGESTED_FILE)
+    records = {}
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            records = json.load(f)
+    ingested = (records.get(output_format) or {}) if append else {}
+    for input_path in paths:
+        ingested[os.path.abspath(input_path)] = _file_state(input_path)
+    records[output_format] = ingested
+    os.makedirs(dir_path, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(records, f, indent=2)
+
+
+def has_histograms(dir_path="data", output_format="store"):
+    """Whether histograms of a format exist in a directory."""
+    if output_format == "store":
+        return os.path.exists(os.path.join(dir_path, "store", HEADER_FILE))
+    if not os.path.isdir(dir_path):
+        return False
+    return any(name.endswith(".json") and name != INGESTED_FILE for name in os.listdir(dir_path))
+
+
 def create_histogram_files(data, dir_path="data"):
     """For each sensor in a dataset, create a 4D histogram JSON file.
     
@@ -86,6 +566,24 @@ def create_histogram_files(data, dir_path="data"):
     dir_path : str
         Where to write the histogram JSONs to (automatically created)
     
+    Returns
+    -------
+    files : list
+        Paths of files produced
+    """
+    return write_histogram_files(create_histograms(data), dir_path)
+
+
+def write_histogram_files(histograms, dir_path="data"):
+    """Write one histogram JSON file per sensor.
+    
+    Parameters
+    ----------
+    histograms : dict
+        Sensor id -> histogram
+    dir_path : str
+        Where to write the histogram JSONs to (automatically created)
+    
     Returns
     -------
     files : list
@@ -93,20 +591,213 @@ def create_histogram_files(data, dir_path="data"):
     """
     os.makedirs(dir_path, exist_ok=True)
     result = []
-    for id in data["id"].unique():
-        histogram = create_histogram(data, id)
+    for id, histogram in histograms.items():
         path = os.path.join(dir_path, "{0}.json".format(id))
         result.append(path)
-        histogram.to_json(path=path)
+        # Replaced at once, readers never see a partial file (and data_source notices the change)
+        temp = temp_path(path)
+        histogram.to_json(path=temp)
+        os.replace(temp, path)
     return result
+
+
+def update_histogram_files(histograms, dir_path="data"):
+    """Add histograms to the existing JSON files (missing ones are created).
     
+    Adaptive axes of the existing histograms are extended if needed.
+    
+    Parameters
+    ----------
+    histograms : dict
+        Sensor id -> histogram with new data only
+    dir_path : str
+    
+    Returns
+    -------
+    files : list
+        Paths of files updated or produced
+    """
+    updated = OrderedDict()
+    for id, histogram in histograms.items():
+        path = os.path.join(dir_path, "{0}.json".format(id))
+        if os.path.exists(path):
+            # Re-created, as loaded histograms do not keep the shape of missed values
+            existing = load_json(path)
+            existing = make_histogram(existing.frequencies, existing.numpy_bins,
+                                      bin_width=existing.meta_data.get("bin_width"),
+                                      name=existing.name, axis_names=existing.axis_names)
+            existing += histogram
+            histogram = existing
+        updated[id] = histogram
+    return write_histogram_files(updated, dir_path)
 
+
+def update_histogram_store(histograms, dir_path=os.path.join("data", "store"), edges=None):
+    """Add histograms to an existing store (created if missing).
+    
+    The store is rewritten with bins extended to include the new data
+    and its prefix sums are removed (see write_store).
+    
+    Parameters
+    ----------
+    histograms : dict
+        Sensor id -> histogram with new data only
+    dir_path : str
+    edges : list[np.ndarray] (optional)
+        Canonical bin layout (default: canonical_edges())
+    
+    Returns
+    -------
+    path : str
+        Path of the store
+    """
+    existing = OrderedDict()
+    if os.path.exists(os.path.join(dir_path, HEADER_FILE)):
+        store = HistogramStore(dir_path)
+        existing.update((id, store.histogram(id)) for id in store.ids)
+        del store    # Release the memory-mapped file before it is rewritten
+    return write_store(merge_histograms([existing, histograms]).values(), dir_path,
+                       edges=edges if edges is not None else canonical_edges())
+
+
+def create_histogram_store(data, dir_path=os.path.join("data", "store")):
+    """Create a binary store with 4D histograms of all sensors in a dataset.
+    
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Dataset with data from different sensors.
+        (as prepared using parse_data_file)
+    dir_path : str
+        Directory of the store (automatically created)
+    
+    Returns
+    -------
+    path : str
+        Path of the store
+        
+    See Also
+    --------
+    histogram_store.HistogramStore
+    """
+    return write_store(create_histograms(data).values(), dir_path, edges=canonical_edges())
+
+
+def create_prefix_sums(dir_path=os.path.join("data", "store"), metadata_path=CSV_FILE):
+    """Precompute prefix sums of a histogram store for the range filters.
+    
+    Sensors are sorted by altitude and by greenery and the cumulative
+    sums of their histograms are stored, so that a sum over any
+    altitude (or greenery) range is a difference of two of them.
+    
+    Parameters
+    ----------
+    dir_path : str
+        Directory of an existing store
+    metadata_path : str
+        The master measure point table
+    
+    Returns
+    -------
+    files : list
+        Paths of files produced
+    """
+    metadata = get_all_point_metadata(path=metadata_path)
+    return [write_prefix_sums(dir_path, column, metadata[column].to_dict())
+            for column in PREFIX_SUM_COLUMNS]
+    
+
+def _range_option(ctx, param, value):
+    try:
+        low, high = (int(item) for item in value.split(","))
+    except ValueError:
+        raise click.BadParameter("Expected two comma-separated integers, like \"2013,2015\"")
+    if low > high:
+        raise click.BadParameter("The range is empty")
+    return low, high
+
+
+@click.option("--format", "output_format", type=click.Choice(["json", "store", "both"]), default="json",
+              help="Write per-sensor JSON files, a single binary store (in OUTDIR/store) or both")
+@click.option("--chunk-size", default=0,
+              help="Read the input in chunks of this many rows (bounded memory use)")
+@click.option("--prefix-sums", is_flag=True,
+              help="Precompute prefix sums for altitude and greenery filters (store only)")
+@click.option("--metadata", default=CSV_FILE, help="Master measure point table (for --prefix-sums)")
+@click.option("--workers", default=0, help="Number of worker processes (default: number of CPUs)")
+@click.option("--datetime-format", default=None,
+              help="Format of timestamps in inputs, like \"%d.%m.%Y %H:%M\" (detected if not set)")
+@click.option("--years", default="{0},{1}".format(*YEAR_RANGE), callback=_range_option,
+              help="Comma-separated range of accepted years (also the years of the store)")
+@click.option("--temperatures", default="{0},{1}".format(*TEMPERATURE_RANGE), callback=_range_option,
+              help="Comma-separated range of accepted temperatures")
+@click.option("--append", is_flag=True,
+              help="Add data from inputs not ingested yet to the existing histograms")
 @click.argument("outdir")
-@click.argument("infile")
+@click.argument("inputs", nargs=-1, required=True)
 @click.command()
-def run(infile, outdir):
-    data = parse_data_file(infile)
-    create_histogram_files(data, outdir)
+def run(inputs, outdir, output_format, chunk_size, prefix_sums, metadata, workers, append, datetime_format,
+        years, temperatures):
+    """Create histograms from INPUTS (files, globs or directories) in OUTDIR."""
+    paths = find_input_files(inputs)
+    if not paths:
+        raise click.UsageError("No input files found.")
+    formats = ["json", "store"] if output_format == "both" else [output_format]
+    options = dict(workers=workers or None, chunk_size=chunk_size, datetime_format=datetime_format,
+                   year_range=years, temperature_range=temperatures)
+    edges = canonical_edges(years, temperatures)
+    store_written = False
+    
+    if not append:
+        histograms = _prepare(paths, outdir, **options)
+        for output_format in formats:
+            if output_format == "json":
+                write_histogram_files(histograms, outdir)
+            else:
+                write_store(histograms.values(), os.path.join(outdir, "store"), edges=edges)
+                store_written = True
+            write_ingested(paths, outdir, output_format)
+    else:
+        # Each format has its own record, inputs are added to each format only once
+        for output_format in formats:
+            ingested = read_ingested(outdir, output_format)
+            if ingested is None:
+                if has_histograms(outdir, output_format):
+                    raise click.UsageError(
+                        "{0} histograms in {1} have no record of ingested inputs, appending could count "
+                        "some data twice. Rebuild them without --append.".format(output_format, outdir))
+                ingested = {}
+            for path in paths:
+                key = os.path.abspath(path)
+                if key in ingested and ingested[key] != _file_state(path):
+                    click.echo("{0} changed after it was ingested, it is skipped "
+                               "(a full rebuild is necessary to update it).".format(path), err=True)
+            new_paths = [path for path in paths if os.path.abspath(path) not in ingested]
+            if not new_paths:
+                click.echo("No new input files for {0} histograms.".format(output_format))
+                continue
+            histograms = _prepare(new_paths, outdir, **options)
+            if output_format == "json":
+                update_histogram_files(histograms, outdir)
+            else:
+                update_histogram_store(histograms, os.path.join(outdir, "store"), edges=edges)
+                store_written = True
+            write_ingested(new_paths, outdir, output_format, append=True)
+    
+    if prefix_sums and store_written:
+        create_prefix_sums(os.path.join(outdir, "store"), metadata)
+
+
+def _prepare(paths, outdir, **options):
+    # prepare_inputs reporting dropped rows
+    counts = {}
+    histograms = prepare_inputs(paths, os.path.join(outdir, PARTIAL_DIR), counts=counts, **options)
+    if counts["dropped"]:
+        click.echo("{0} of {1} rows were dropped (invalid, or outside years {2}-{3} "
+                   "or temperatures {4}-{5}).".format(counts["dropped"], counts["rows"] + counts["dropped"],
+                                                      *(options["year_range"] + options["temperature_range"])),
+                   err=True)
+    return histograms
 
 
 if __name__ == "__main__":
@@ -0,0 +1,223 @@
+"""Bounded caches of query results and rendered images."""
+
+import os
+import pickle
+import shutil
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+from file_utils import TEMP_SUFFIX, temp_path
+
+
+class ResultCache:
+    """LRU cache limited by the (estimated) size of results in bytes.
+
+    Each result is stored together with a version of the data it was
+    computed from. A result is returned only if the version matches,
+    otherwise it counts as a miss.
+
+    Optionally, results are pickled to a directory as well (with its own
+    size limit, the least recently used files are deleted first),
+    so that they survive restarts and can be shared between processes.
+
+    Attributes
+    ----------
+    hits : int
+    misses : int
+    """
+    def __init__(self, max_bytes=64 * 1024 ** 2, directory=None, max_disk_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._bytes = 0
+
+    def get(self, key, version):
+        """Find a result.
+
+        Parameters
+        ----------
+        key : tuple
+            Hashable (and for disk cache, repr-able) normalized query
+        version : str
+            Version of the data (see data_source.get_data_version)
+
+        Returns
+        -------
+        found : bool
+        result : object
+        """
+        item = self._items.get(key)
+        if item is not None and item[0] == version:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return True, item[1]
+        if self.directory:
+            path = self._path(key, version)
+            if os.path.exists(path):
+                with open(path, "rb") as f:
+                    result = pickle.load(f)
+                os.utime(path)
+                self._store(key, version, result)
+                self.hits += 1
+                return True, result
+        self.misses += 1
+        return False, None
+
+    def put(self, key, version, result):
+        """Add a result to the cache."""
+        self._store(key, version, result)
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self._path(key, version)
+            temp = temp_path(path)
+            with open(temp, "wb") as f:
+                pickle.dump(result, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, path)
+            evict_files(self.directory, ".pickle", self.max_disk_bytes)
+
+    def clear(self):
+        """Remove all results from memory (files are kept)."""
+        self._items.clear()
+        self._bytes = 0
+
+    def stats(self):
+        """Counters and sizes.
+
+        Returns
+        -------
+        dict
+        """
+        return {"hits": self.hits, "misses": self.misses,
+                "items": len(self._items), "bytes": self._bytes}
+
+    def _store(self, key, version, result):
+        size = estimate_size(result)
+        if size > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+        self._items[key] = (version, result, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, _, old_size) = self._items.popitem(last=False)
+            self._bytes -= old_size
+
+    def _path(self, key, version):
+        return os.path.join(self.directory, cache_digest(key, version) + ".pickle")
+
+
+class ImageCache:
+    """Directory of rendered images named by a hash of the query.
+
+    Cached images have the extension of the paths they are copied
+    from / to (suffix is used for paths without one).
+
+    The least recently used images are deleted when the directory
+    grows over max_bytes.
+
+    Attributes
+    ----------
+    hits : int
+    misses : int
+    """
+    def __init__(self, directory, max_bytes=256 * 1024 ** 2, suffix=".png"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, path):
+        """Copy a cached image to path.
+
+        Parameters
+        ----------
+        key : tuple
+            Normalized query including all render parameters
+        version : str
+            Version of the data (see data_source.get_data_version)
+        path : str
+            Where to copy the image
+
+        Returns
+        -------
+        found : bool
+        """
+        cached_path = self._path(key, version, path)
+        try:
+            shutil.copyfile(cached_path, path)
+        except FileNotFoundError:
+            self.misses += 1
+            return False
+        os.utime(cached_path)
+        self.hits += 1
+        return True
+
+    def put(self, key, version, path):
+        """Store a copy of a rendered image."""
+        os.makedirs(self.directory, exist_ok=True)
+        cached_path = self._path(key, version, path)
+        temp = temp_path(cached_path)
+        shutil.copyfile(path, temp)
+        os.replace(temp, cached_path)
+        evict_files(self.directory, "", self.max_bytes)
+
+    def stats(self):
+        """Counters.
+
+        Returns
+        -------
+        dict
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _path(self, key, version, path):
+        suffix = os.path.splitext(path)[1] or self.suffix
+        return os.path.join(self.directory, cache_digest(key, version) + suffix.lower())
+
+
+def cache_digest(key, version):
+    """Stable name of a cache entry (the same across processes)."""
+    return hashlib.sha1(repr((key, version)).encode("utf-8")).hexdigest()
+
+
+def evict_files(directory, suffix, max_bytes):
+    """Delete least recently used files until they fit in max_bytes.
+
+    Cache hits touch the files, so their mtime is the time of last use.
+    Files being written (see file_utils.temp_path) are skipped.
+    """
+    stats = []
+    for entry in os.scandir(directory):
+        if entry.name.endswith(suffix) and not entry.name.endswith(TEMP_SUFFIX):
+            stat = entry.stat()
+            stats.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in stats)
+    for _, size, path in sorted(stats):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass    # Removed by another process
+        total -= size
+
+
+def estimate_size(result):
+    """Approximate memory used by a query result in bytes.
+
+    Only the numpy arrays are counted (plus a fixed overhead).
+    """
+    size = 1024
+    if result is not None:
+        for name in ("frequencies", "errors2"):
+            array = getattr(result, name, None)
+            if isinstance(array, np.ndarray):
+                size += array.nbytes
+    return size
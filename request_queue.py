@@ -0,0 +1,48 @@
+"""Hand-over of plot requests to a single worker thread."""
+
+import threading
+
+
+class LatestRequestQueue:
+    """Queue holding only the most recent request.
+
+    A request that has not been taken by the worker yet is replaced
+    by a newer one and passed to the dropped callback (the worker
+    would render it only to throw the result away).
+
+    Parameters
+    ----------
+    dropped_callback : callable, optional
+        Called with each replaced request (under the lock of the queue)
+    """
+    def __init__(self, dropped_callback=None):
+        self.dropped_callback = dropped_callback
+        self.pending = None
+        self.running = True
+        self.condition = threading.Condition()
+
+    def submit(self, request):
+        with self.condition:
+            if self.pending and self.dropped_callback:
+                self.dropped_callback(self.pending)
+            self.pending = request
+            self.condition.notify()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+    def next_request(self):
+        """Wait for a request.
+
+        Returns
+        -------
+        request : dict or None
+            None when the queue has been stopped
+        """
+        with self.condition:
+            while self.running and not self.pending:
+                self.condition.wait()
+            request, self.pending = self.pending, None
+            return request if self.running else None
@@ -0,0 +1,76 @@
+"""Shared fixtures: a working directory with generated data.
+
+data_source reads files relative to the current directory, so each test
+using the workdir fixture runs in its own temporary directory with
+a synthetic meta-data table and raw data (see benchmarks/pipeline.py).
+
+Run from the repository: python -m pytest tests
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+import data_source
+from histogram_data import Histogram
+from pipeline import generate_metadata, generate_raw_data
+from physt import h1
+from physt.io.json import parse_json
+
+
+SENSORS = 12
+YEARS = 2
+ROWS = 5000
+
+
+def physt_reads_json():
+    """Whether physt can read its JSON files (older versions fail on Python 3.9+)."""
+    try:
+        parse_json(h1([1, 2, 3]).to_json())
+    except TypeError:
+        return False
+    return True
+
+
+requires_json = pytest.mark.skipif(not physt_reads_json(), reason="physt cannot read JSON histograms here")
+
+
+def reset_data_source():
+    """Forget all data cached by data_source (as in a new process)."""
+    data_source._clear_caches()
+    data_source._data_version = None
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Temporary working directory with a meta-data table and a raw data file.
+
+    Returns
+    -------
+    ids : list[str]
+        Sensor ids
+    """
+    monkeypatch.chdir(tmp_path)
+    ids = generate_metadata(data_source.CSV_FILE, SENSORS)
+    generate_raw_data("raw.csv", ids, YEARS, ROWS)
+    reset_data_source()
+    yield ids
+    reset_data_source()
+
+
+def assert_same_histogram(a, b):
+    """Histograms equal up to empty bins at the edges."""
+    assert (a is None) == (b is None)
+    if a is None:
+        return
+    assert a.axis_names == b.axis_names
+    # Both extended to the union of their bins
+    a_zero = Histogram(np.zeros(a.shape, dtype=np.int64), a.edges, a.axis_names)
+    b_zero = Histogram(np.zeros(b.shape, dtype=np.int64), b.edges, b.axis_names)
+    np.testing.assert_array_equal((a + b_zero).frequencies, (b + a_zero).frequencies)
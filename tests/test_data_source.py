@@ -0,0 +1,74 @@
+import glob
+import os
+
+import data_source
+import prepare
+from histogram_store import HistogramStore
+
+from conftest import assert_same_histogram, requires_json
+
+
+ALTITUDE_RANGE = (250, 300)
+GREENERY_RANGE = (0.2, 0.4)
+
+
+def get_queries(ids):
+    address = data_source.get_point_meta_data(ids[0])["Adresa"]
+    return [
+        dict(id=ids[0], axes=("month", "temperature")),
+        dict(id=ids[1], hour=12, axes=("month", "temperature")),
+        dict(address=address, axes=("hour", "temperature")),
+        dict(altitude_range=ALTITUDE_RANGE, axes=("hour", "temperature")),
+        dict(greenery_range=GREENERY_RANGE, month=7, axes=("hour", "temperature")),
+        dict(altitude_range=ALTITUDE_RANGE, greenery_range=GREENERY_RANGE, axes=("month", "temperature")),
+        dict(year=prepare.YEAR_RANGE[0], axes=("month", "temperature")),
+        # As sent by the GUI, with one slider at its full range
+        dict(altitude_range=ALTITUDE_RANGE, greenery_range=(0, 1), axes=("hour", "temperature")),
+    ]
+
+
+def test_store_and_prefix_sums_agree(workdir):
+    data = prepare.parse_data_file("raw.csv")
+    prepare.create_histogram_store(data, data_source.STORE_DIR)
+    queries = get_queries(workdir)
+    store_results = [data_source.get_temperature_data(**query) for query in queries]
+    assert data_source.get_prefix_sums("vyska") is None
+
+    prepare.create_prefix_sums(data_source.STORE_DIR, data_source.CSV_FILE)
+    prefix_results = [data_source.get_temperature_data(**query) for query in queries]
+    assert data_source.get_prefix_sums("vyska") is not None
+
+    assert sum(h.total for h in store_results) > 0
+    for store_result, prefix_result in zip(store_results, prefix_results):
+        assert_same_histogram(store_result, prefix_result)
+
+
+@requires_json
+def test_json_and_store_agree(workdir):
+    data = prepare.parse_data_file("raw.csv")
+    prepare.create_histogram_files(data, data_source.DATA_DIR)
+    queries = get_queries(workdir)
+    json_results = [data_source.get_temperature_data(**query) for query in queries]
+    assert data_source.get_store() is None
+
+    for path in glob.glob(os.path.join(data_source.DATA_DIR, "*.json")):
+        os.remove(path)
+    prepare.create_histogram_store(data, data_source.STORE_DIR)
+    store_results = [data_source.get_temperature_data(**query) for query in queries]
+
+    assert sum(h.total for h in json_results) > 0
+    for json_result, store_result in zip(json_results, store_results):
+        assert_same_histogram(json_result, store_result)
+
+
+def test_full_range_uses_prefix_sums(workdir, monkeypatch):
+    prepare.create_histogram_store(prepare.parse_data_file("raw.csv"), data_source.STORE_DIR)
+    prepare.create_prefix_sums(data_source.STORE_DIR, data_source.CSV_FILE)
+
+    def aggregate(self, rows):
+        raise AssertionError("Aggregated from the store")
+
+    monkeypatch.setattr(HistogramStore, "aggregate", aggregate)
+    data = data_source.get_temperature_data(altitude_range=ALTITUDE_RANGE, greenery_range=(0, 1),
+                                            axes=("hour", "temperature"))
+    assert data.total > 0
@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from histogram_data import Histogram
+
+
+@pytest.fixture
+def histogram():
+    # year (2013, 2014), month (1-12), temperature (-5..5)
+    edges = [np.arange(2013, 2016) - 0.5, np.arange(1, 14) - 0.5, np.arange(-5, 6, dtype=float)]
+    frequencies = np.arange(2 * 12 * 10).reshape(2, 12, 10)
+    return Histogram(frequencies, edges, ["year", "month", "temperature"])
+
+
+def test_query_value(histogram):
+    h = histogram.query(values={"year": 2014}, axes=["temperature"])
+    np.testing.assert_array_equal(h.frequencies, histogram.frequencies[1].sum(axis=0))
+    assert h.axis_names == ("temperature",)
+
+
+@pytest.mark.parametrize("year", [2012, 2015, 1900, 3000])
+def test_query_value_outside_bins(histogram, year):
+    h = histogram.query(values={"year": year}, axes=["month", "temperature"])
+    assert h.shape == (12, 10)
+    assert h.axis_names == ("month", "temperature")
+    assert not h.frequencies.any()
+
+
+def test_query_values_outside_bins_without_axes(histogram):
+    h = histogram.query(values={"year": 2013, "month": 13})
+    assert h.shape == (10,)
+    assert not h.frequencies.any()
+    np.testing.assert_array_equal(h.edges[0], histogram.edges[2])
+
+
+def test_bin_index_outside_bins(histogram):
+    assert histogram.bin_index("month", 0) is None
+    assert histogram.bin_index("month", 12.6) is None
+    assert histogram.bin_index("month", 12) == 11
+    assert histogram.bin_index("temperature", -5) == 0
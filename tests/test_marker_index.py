@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from marker_index import MarkerIndex, group_points, project
+
+
+def brute_force_nearest(x, y, px, py, radius):
+    distances = (x - px) ** 2 + (y - py) ** 2
+    best = np.argmin(distances)
+    return int(best) if distances[best] < radius ** 2 else None
+
+
+@pytest.mark.parametrize("cell_size", [0.01, 0.05, 0.2])
+def test_nearest_matches_brute_force(cell_size):
+    rng = np.random.RandomState(0)
+    x, y = rng.uniform(-1, 1, 500), rng.uniform(-1, 1, 500)
+    index = MarkerIndex(x, y, cell_size)
+    for px, py in rng.uniform(-1.2, 1.2, (1000, 2)):
+        assert index.nearest(px, py, cell_size) == brute_force_nearest(x, y, px, py, cell_size)
+
+
+def test_nearest_without_points():
+    index = MarkerIndex(np.empty(0), np.empty(0), 0.1)
+    assert len(index) == 0
+    assert index.nearest(0, 0, 0.1) is None
+
+
+def test_group_points():
+    x = np.array([0.05, 0.15, 0.12, 0.95])
+    y = np.array([0.05, 0.05, 0.08, 0.95])
+    cells, labels = group_points(x, y, 0.1)
+    np.testing.assert_array_equal(cells[labels], [[0, 0], [1, 0], [1, 0], [9, 9]])
+
+
+def test_project():
+    x, y = project([0, 85.1, -85.1], [-180, 0, 180])
+    np.testing.assert_allclose(x, [0, 0.5, 1])
+    np.testing.assert_allclose(y, [0.5, 1, 0], atol=1e-3)
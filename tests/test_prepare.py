@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+from physt.io import load_json
+
+import data_source
+import prepare
+from histogram_data import Histogram
+from histogram_store import HistogramStore
+
+from conftest import assert_same_histogram, requires_json
+from pipeline import generate_raw_data
+
+
+@pytest.mark.parametrize("output_format", ["store", pytest.param("json", marks=requires_json)])
+def test_append_matches_rebuild(workdir, output_format):
+    generate_raw_data("more.csv", workdir, 2, 3000, seed=1)
+    runner = CliRunner()
+    options = ["--format", output_format, "--workers", "1"]
+
+    result = runner.invoke(prepare.run, options + ["raw.csv", "more.csv", "full"])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(prepare.run, options + ["raw.csv", "appended"])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(prepare.run, options + ["--append", "raw.csv", "more.csv", "appended"])
+    assert result.exit_code == 0, result.output
+    assert prepare.read_ingested("full", output_format).keys() == \
+        prepare.read_ingested("appended", output_format).keys()
+
+    if output_format == "store":
+        full = HistogramStore(os.path.join("full", "store"))
+        appended = HistogramStore(os.path.join("appended", "store"))
+        assert sorted(full.ids) == sorted(appended.ids)
+        for id in full.ids:
+            assert_same_histogram(full.view(id), appended.view(id))
+    else:
+        for id in workdir:
+            assert_same_histogram(Histogram.from_physt(load_json(os.path.join("full", id + ".json"))),
+                                  Histogram.from_physt(load_json(os.path.join("appended", id + ".json"))))
+
+
+def test_append_without_record_is_refused(workdir):
+    runner = CliRunner()
+    result = runner.invoke(prepare.run, ["--format", "store", "--workers", "1", "raw.csv", "data"])
+    assert result.exit_code == 0, result.output
+    total = HistogramStore(os.path.join("data", "store")).frequencies.sum()
+    os.remove(os.path.join("data", data_source.INGESTED_FILE))
+
+    result = runner.invoke(prepare.run, ["--format", "store", "--workers", "1", "--append", "raw.csv", "data"])
+    assert result.exit_code != 0
+    assert HistogramStore(os.path.join("data", "store")).frequencies.sum() == total
+
+
+def test_append_records_formats_separately(workdir):
+    generate_raw_data("more.csv", workdir, 2, 3000, seed=1)
+    runner = CliRunner()
+    options = ["--workers", "1"]
+
+    result = runner.invoke(prepare.run, options + ["--format", "store", "raw.csv", "more.csv", "full"])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(prepare.run, options + ["--format", "store", "raw.csv", "appended"])
+    assert result.exit_code == 0, result.output
+    # Ingested into JSON files only, the store still lacks more.csv
+    result = runner.invoke(prepare.run, options + ["--format", "json", "--append", "raw.csv", "more.csv", "appended"])
+    assert result.exit_code == 0, result.output
+    assert len(prepare.read_ingested("appended", "json")) == 2
+    assert len(prepare.read_ingested("appended", "store")) == 1
+
+    result = runner.invoke(prepare.run, options + ["--format", "store", "--append", "raw.csv", "more.csv", "appended"])
+    assert result.exit_code == 0, result.output
+    full = HistogramStore(os.path.join("full", "store"))
+    appended = HistogramStore(os.path.join("appended", "store"))
+    for id in full.ids:
+        assert_same_histogram(full.view(id), appended.view(id))
+
+
+@pytest.mark.parametrize("chunk_size", [None, 777, 5000])
+def test_histograms_match_per_sensor(workdir, chunk_size):
+    data = prepare.parse_data_file("raw.csv")
+    if chunk_size:
+        # Chunks split the rows of most sensors
+        histograms = prepare.accumulate_histograms(prepare.parse_data_chunks("raw.csv", chunk_size=chunk_size))
+    else:
+        histograms = prepare.create_histograms(data)
+    assert sorted(histograms) == sorted(data["id"].unique())
+    for id, histogram in histograms.items():
+        expected = prepare.create_histogram(data, id)
+        assert histogram.frequencies.sum() > 0
+        np.testing.assert_array_equal(histogram.frequencies, expected.frequencies)
+        for bins, expected_bins in zip(histogram.numpy_bins, expected.numpy_bins):
+            np.testing.assert_array_equal(bins, expected_bins)
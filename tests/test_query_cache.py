@@ -0,0 +1,53 @@
+import data_source
+import prepare
+from plotting import render_temperature_data
+
+
+def test_caches_follow_data(workdir):
+    data = prepare.parse_data_file("raw.csv")
+    query = dict(id=workdir[0], axes=("month", "temperature"))
+
+    prepare.create_histogram_store(data.iloc[:len(data) // 2], data_source.STORE_DIR)
+    first = data_source.get_temperature_data(**query)
+    hits = data_source.result_cache.hits
+    assert data_source.get_temperature_data(**query) is first
+    assert data_source.result_cache.hits == hits + 1
+
+    render_temperature_data("first.png", **query)
+    image_hits = data_source.image_cache.hits
+    render_temperature_data("again.png", **query)
+    assert data_source.image_cache.hits == image_hits + 1
+
+    version = data_source.get_data_version()
+    prepare.create_histogram_store(data, data_source.STORE_DIR)
+    assert data_source.get_data_version() != version
+    second = data_source.get_temperature_data(**query)
+    assert second.total > first.total
+
+    image_misses = data_source.image_cache.misses
+    render_temperature_data("second.png", **query)
+    assert data_source.image_cache.misses == image_misses + 1
+
+
+def test_image_formats_cached_separately(workdir):
+    prepare.create_histogram_store(prepare.parse_data_file("raw.csv"), data_source.STORE_DIR)
+    query = dict(id=workdir[0], axes=("month", "temperature"))
+    render_temperature_data("plot.png", **query)
+    misses = data_source.image_cache.misses
+    render_temperature_data("plot.svg", **query)
+    assert data_source.image_cache.misses == misses + 1
+    with open("plot.svg", "rb") as f:
+        assert b"<svg" in f.read(1000)
+
+
+def test_forced_refresh(workdir):
+    prepare.create_histogram_store(prepare.parse_data_file("raw.csv"), data_source.STORE_DIR)
+    query = dict(id=workdir[0], axes=("month", "temperature"))
+    first = data_source.get_temperature_data(**query)
+    version = data_source.get_data_version()
+
+    data_source.refresh_caches(force=True)
+    assert data_source.get_data_version() != version
+    second = data_source.get_temperature_data(**query)
+    assert second is not first
+    assert second.total == first.total